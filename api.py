@@ -0,0 +1,302 @@
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import deque
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+import engine
+import jobs
+import metrics
+from ingest import UploadError, read_user_articles
+from output_cache import OUTPUT_CACHE
+from pipeline import resolve_upload, warm_reference
+from refdata import LIBRARY_PATH, MASTER_PATH, REFERENCE_CACHE, library_data, master_data
+
+#####################
+# Local HTTP conversion API
+#####################
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+REQUEST_TIMEOUT_SECONDS = 300
+LATENCY_WINDOW = 1000
+
+CONTENT_TYPES = {
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".zip": "application/zip",
+}
+
+
+class ApiError(Exception):
+    """An error answered with `status` and a JSON {"error": message} body."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyStats:
+    """Latency of the last LATENCY_WINDOW requests per endpoint, with percentiles."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = {}
+        self._counts = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self._window)).append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def summary(self):
+        """Returns {endpoint: {"count", "p50_ms", "p90_ms", "p99_ms", "max_ms"}}."""
+        with self._lock:
+            samples = {endpoint: sorted(values) for endpoint, values in self._samples.items()}
+            counts = dict(self._counts)
+        summary = {}
+        for endpoint, values in samples.items():
+            def percentile(q):
+                return round(1000 * values[min(int(q * len(values)), len(values) - 1)], 1)
+            summary[endpoint] = {
+                "count": counts[endpoint],
+                "p50_ms": percentile(0.5),
+                "p90_ms": percentile(0.9),
+                "p99_ms": percentile(0.99),
+                "max_ms": round(1000 * values[-1], 1),
+            }
+        return summary
+
+
+def _flag(query, name):
+    return query.get(name, [""])[0].strip().lower() in ("1", "true", "yes", "on")
+
+
+def _read_articles(upload):
+    """
+    read_user_articles, with any failure to read the upload raised as an
+    UploadError carrying the message engine.read_upload shows in the app.
+    """
+    try:
+        with metrics.stage("read_upload") as record:
+            df_user = read_user_articles(upload)
+            record["rows"] = len(df_user)
+        return df_user
+    except UploadError:
+        raise
+    except Exception as e:
+        raise UploadError(f"Fejl ved læsning af fil: {e}") from e
+
+
+def _route(method, path):
+    """
+    The latency key of a request: its endpoint, or "other" for unknown paths
+    and methods, so arbitrary request paths cannot grow LatencyStats.
+    """
+    routes = {("GET", "/health"), ("POST", "/articles")}
+    routes.update(("POST", f"/convert/{kind}") for kind in engine.OUTPUTS)
+    return f"{method} {path}" if (method, path) in routes else "other"
+
+
+class ConversionApi:
+    """
+    WSGI application exposing the converter to other tools:
+
+      POST /articles                 upload -> preprocessed rows as JSON
+      POST /convert/presentation     upload -> product-list.docx
+      POST /convert/order_import     upload -> order-import.xlsx
+      POST /convert/sku_masterdata   upload -> SKUmapping-masterdata.xlsx
+      POST /convert/all              upload -> pcon-outputs.zip
+      GET  /health                   reference versions, latency percentiles, jobs, caches
+
+    The request body is the raw pCon export; `?filename=export.csv` (or an
+    X-Filename header) tells CSV from XLSX. `?consolidated=1` and
+    `?suggestions=N` select the output options of the app.
+
+    The reference data and lookup indexes are loaded once and stay warm in
+    the process-wide caches. Conversions, including reading the upload, run
+    on a bounded worker pool (jobs.JobRunner), so concurrent requests queue
+    instead of oversubscribing the CPU, and identical concurrent requests
+    share one conversion.
+    """
+
+    def __init__(self, library_path=LIBRARY_PATH, master_path=MASTER_PATH, workers=None):
+        self.library_path = library_path
+        self.master_path = master_path
+        self.runner = jobs.JobRunner(workers)
+        self.latency = LatencyStats()
+        self.started_at = time.time()
+
+    def warm(self):
+        """Loads the reference data and builds the lookup indexes."""
+        warm_reference(*self._reference())
+
+    def _reference(self):
+        return library_data(self.library_path), master_data(self.master_path)
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        method = environ.get("REQUEST_METHOD", "GET")
+        path = environ.get("PATH_INFO", "/").rstrip("/") or "/"
+        try:
+            status, headers, body = self._dispatch(method, path, environ)
+        except ApiError as e:
+            body = json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+            status, headers = e.status, [("Content-Type", "application/json; charset=utf-8")]
+        except Exception as e:
+            body = json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False).encode("utf-8")
+            status, headers = "500 Internal Server Error", [("Content-Type", "application/json; charset=utf-8")]
+        self.latency.record(_route(method, path), time.perf_counter() - start)
+        start_response(status, headers + [("Content-Length", str(len(body)))])
+        return [body]
+
+    def _dispatch(self, method, path, environ):
+        if path == "/health" and method == "GET":
+            return self._json(self.health())
+        if method != "POST":
+            raise ApiError("405 Method Not Allowed", f"{method} {path} is not supported.")
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        upload = self._read_upload(environ, query)
+        if path == "/articles":
+            digest = hashlib.sha1(upload.getvalue()).hexdigest()
+            job = self.runner.submit(("articles", digest), f"api {upload.name}: articles", lambda: _read_articles(upload))
+            df_user = self._result(job, "articles")
+            return self._json({"rows": len(df_user), "articles": json.loads(df_user.to_json(orient="records"))})
+        if path.startswith("/convert/"):
+            return self._convert(path[len("/convert/"):], upload, query)
+        raise ApiError("404 Not Found", f"Unknown endpoint {path}.")
+
+    def _read_upload(self, environ, query):
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            raise ApiError("400 Bad Request", "The request body must contain the pCon export.")
+        upload = io.BytesIO(environ["wsgi.input"].read(length))
+        upload.name = query.get("filename", [environ.get("HTTP_X_FILENAME", "upload.xlsx")])[0]
+        return upload
+
+    def _convert(self, kind, upload, query):
+        if kind not in engine.OUTPUTS:
+            raise ApiError("404 Not Found", f"Unknown output '{kind}'. Choose one of: {', '.join(engine.OUTPUTS)}.")
+        consolidated = _flag(query, "consolidated")
+        try:
+            suggestions = int(query.get("suggestions", ["0"])[0])
+        except ValueError:
+            raise ApiError("400 Bad Request", "suggestions must be a number.")
+        if suggestions < 0:
+            raise ApiError("400 Bad Request", "suggestions must be 0 or more.")
+        df_library, df_master = self._reference()
+        digest = hashlib.sha1(upload.getvalue()).hexdigest()
+        file_name, expected_stages, build = engine.OUTPUTS[kind]
+
+        def convert():
+            # Reading and matching the upload run in the job too, so the worker
+            # pool bounds parsing as well as generation
+            resolved = resolve_upload(digest, df_library, df_master, lambda: _read_articles(upload))
+            return build(resolved, consolidated, suggestions)
+
+        # Keyed by content (see engine.output_key), never by object ids that
+        # CPython reuses once a reference frame or upload is freed
+        options = (consolidated, suggestions)
+        key = (engine.upload_output_key(digest, df_library, df_master, kind, options)
+               or (kind, digest, df_library, df_master, options))
+        job = self.runner.submit(key, f"api {upload.name}: {file_name}", convert, expected_stages + 1)
+        result = self._result(job, file_name)
+        extension = file_name[file_name.rfind("."):]
+        return "200 OK", [
+            ("Content-Type", CONTENT_TYPES.get(extension, "application/octet-stream")),
+            ("Content-Disposition", f'attachment; filename="{file_name}"'),
+        ], result.getvalue()
+
+    @staticmethod
+    def _result(job, what):
+        """Waits for a job and returns its result; an unreadable upload is a 400, other failures a 422."""
+        if not job.wait(REQUEST_TIMEOUT_SECONDS):
+            raise ApiError("504 Gateway Timeout", f"{what} was not ready within {REQUEST_TIMEOUT_SECONDS}s.")
+        if isinstance(job.exception, UploadError):
+            raise ApiError("400 Bad Request", str(job.exception))
+        if job.status != jobs.DONE:
+            raise ApiError("422 Unprocessable Entity", job.error or f"{what} could not be generated.")
+        return job.result
+
+    def health(self):
+        """Liveness plus reference data versions, latency percentiles, job and cache counters."""
+        return {
+            "status": "ok",
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "reference": REFERENCE_CACHE.stats(),
+            "latency": self.latency.summary(),
+            "jobs": self.runner.stats(),
+            "output_cache": OUTPUT_CACHE.stats(),
+        }
+
+    @staticmethod
+    def _json(payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        return "200 OK", [("Content-Type", "application/json; charset=utf-8")], body
+
+
+class ApiClient:
+    """
+    In-process client for ConversionApi: calls the WSGI application directly,
+    without a socket, e.g. for offline tests and scripts.
+
+        client = ApiClient(ConversionApi())
+        status, headers, body = client.post("/convert/order_import?filename=export.xlsx", data)
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+    def get(self, path):
+        return self.request("GET", path)
+
+    def post(self, path, data, headers=None):
+        return self.request("POST", path, data, headers)
+
+    def request(self, method, path, data=b"", headers=None):
+        """Returns (status code, headers dict, body bytes)."""
+        path, _, query = path.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "CONTENT_LENGTH": str(len(data)),
+            "wsgi.input": io.BytesIO(data),
+        }
+        for name, value in (headers or {}).items():
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+        setup_testing_defaults(environ)
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = dict(response_headers)
+
+        body = b"".join(self.api(environ, start_response))
+        return response["status"], response["headers"], body
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, library_path=LIBRARY_PATH, master_path=MASTER_PATH):
+    """Entry point of `python -m app serve`: warms the reference data and serves the API until interrupted."""
+    api = ConversionApi(library_path, master_path, workers)
+    api.warm()
+    with make_server(host, port, api, server_class=_ThreadingWSGIServer) as server:
+        print(f"Serving the conversion API on http://{host}:{port} (GET /health)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
@@ -0,0 +1,223 @@
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import engine
+import metrics
+from ingest import read_user_articles
+from lookup import MATCH_DIRECT, MATCH_FALLBACK
+from pipeline import ResolvedUpload, warm_reference
+from refdata import LIBRARY_PATH, MASTER_PATH, library_data, master_data
+
+#####################
+# Batch conversion of many pCon exports
+#####################
+
+UPLOAD_EXTENSIONS = (".xlsx", ".csv")
+
+_reference = {}
+
+
+def expand_inputs(inputs):
+    """
+    Expands the given files, directories and glob patterns into a sorted list
+    of pCon export files (.xlsx / .csv). Directories are searched non-recursively.
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item) or [item]
+        for path in candidates:
+            name = os.path.basename(path)
+            if os.path.isfile(path) and name.lower().endswith(UPLOAD_EXTENSIONS) and not name.startswith("~$"):
+                paths.add(path)
+    return sorted(paths)
+
+
+def output_names(paths):
+    """
+    Returns {path: output folder name} for a batch: the path relative to the
+    common folder of all inputs, without the extension, so exports sharing a
+    file name in different project folders get their own folders (e.g.
+    `projekt-a/pCon - exceleksport`). Files differing only by extension in
+    one folder get the extension as a suffix (`x-xlsx`, `x-csv`). Raises
+    ValueError if two exports would still share a folder.
+    """
+    if not paths:
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    stems = {path: os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0] for path in paths}
+    counts = {}
+    for stem in stems.values():
+        counts[stem] = counts.get(stem, 0) + 1
+    names = {}
+    for path, stem in stems.items():
+        if counts[stem] > 1:
+            names[path] = f"{stem}-{os.path.splitext(path)[1][1:].lower()}"
+        else:
+            names[path] = stem
+    if len(set(names.values())) != len(names):
+        raise ValueError("Two exports map to the same output folder; rename one of them.")
+    return names
+
+
+def load_reference(library_path=LIBRARY_PATH, master_path=MASTER_PATH):
+    """
+    Loads the reference data and builds the lookup indexes for this process.
+    Called once in the parent before the pool starts (forked workers inherit
+    the warm data) and once per worker as the pool initializer.
+    """
+    df_library = library_data(library_path)
+    df_master = master_data(master_path)
+    warm_reference(df_library, df_master)
+    _reference["library"] = df_library
+    _reference["master"] = df_master
+
+
+def _match_rates(resolution):
+    if resolution is None or len(resolution) == 0:
+        return {"direct": 0.0, "fallback": 0.0, "unmatched": 0.0}
+    counts = resolution["MATCH"].value_counts(normalize=True)
+    direct = float(counts.get(MATCH_DIRECT, 0.0))
+    fallback = float(counts.get(MATCH_FALLBACK, 0.0))
+    return {
+        "direct": round(direct, 4),
+        "fallback": round(fallback, 4),
+        "unmatched": round(1.0 - direct - fallback, 4),
+    }
+
+
+def _region_counts(resolution):
+    """Number of upload rows matched per Library key column (EUR/GBP/APMEA/USD)."""
+    if resolution is None:
+        return {}
+    matched = resolution["REGION"][resolution["REGION"] != ""]
+    return {str(region): int(count) for region, count in matched.value_counts().items()}
+
+
+def convert_file(path, out_dir, consolidated=False, suggestions=0, name=None):
+    """
+    Converts one pCon export into the three output files, written to
+    `<out_dir>/<name>/`, by default the file name without extension (see
+    output_names, and engine.generate_all_outputs for `consolidated` and
+    `suggestions`). Returns a summary dict with the output folder, timing,
+    per-stage timings, row count and Library/master match rates; failures
+    are reported in the summary instead of being raised.
+    """
+    start = time.perf_counter()
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    summary = {"file": path, "output": name, "status": "ok"}
+    with metrics.run(path) as run_metrics:
+        try:
+            with metrics.stage("read_upload") as record, open(path, "rb") as fh:
+                df_user = read_user_articles(fh)
+                record["rows"] = len(df_user)
+            resolved = ResolvedUpload(df_user, _reference["library"], _reference["master"])
+            outputs = engine.generate_all_outputs(resolved, consolidated, suggestions)
+
+            target_dir = os.path.join(out_dir, name)
+            os.makedirs(target_dir, exist_ok=True)
+            with metrics.stage("write_files", rows=len(outputs)):
+                for file_name, buffer in outputs.items():
+                    with open(os.path.join(target_dir, file_name), "wb") as out:
+                        out.write(buffer.getvalue())
+
+            summary.update({
+                "rows": len(df_user),
+                "outputs": sorted(outputs),
+                "library_match": _match_rates(resolved.library),
+                "master_match": _match_rates(resolved.master),
+                "library_regions": _region_counts(resolved.library),
+            })
+        except Exception as e:
+            summary.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    summary["stages"] = run_metrics.stages
+    return summary
+
+
+def convert_many(paths, out_dir, workers=None, library_path=LIBRARY_PATH, master_path=MASTER_PATH, consolidated=False,
+                 suggestions=0):
+    """
+    Converts many exports, fanning the files out over a process pool of
+    `workers` processes (default: all cores; 1 converts in this process).
+    Returns the per-file summaries in input order.
+    """
+    names = output_names(paths)
+    load_reference(library_path, master_path)
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        return [convert_file(path, out_dir, consolidated, suggestions, names[path]) for path in paths]
+
+    summaries = {}
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(paths)),
+        initializer=load_reference,
+        initargs=(library_path, master_path),
+    ) as pool:
+        futures = {
+            pool.submit(convert_file, path, out_dir, consolidated, suggestions, names[path]): path for path in paths
+        }
+        for future in as_completed(futures):
+            summaries[futures[future]] = future.result()
+    return [summaries[path] for path in paths]
+
+
+def format_summary(summaries, elapsed):
+    """Returns a plain-text table of the per-file summaries and a totals line."""
+    lines = [f"{'file':40}  {'status':6}  {'rows':>7}  {'seconds':>8}  {'lib direct/fallback':>20}  {'master direct/fallback':>22}"]
+    total_rows = 0
+    for summary in summaries:
+        # The output folder: unique within the batch, unlike the base name
+        name = summary.get("output", os.path.basename(summary["file"]))[-40:]
+        if summary["status"] != "ok":
+            lines.append(f"{name:40}  {'error':6}  {'':>7}  {summary['seconds']:>8.3f}  {summary['error']}")
+            continue
+        total_rows += summary["rows"]
+        lib, master = summary["library_match"], summary["master_match"]
+        lines.append(
+            f"{name:40}  {'ok':6}  {summary['rows']:>7}  {summary['seconds']:>8.3f}  "
+            f"{lib['direct']:>10.1%}/{lib['fallback']:<9.1%}  {master['direct']:>11.1%}/{master['fallback']:<10.1%}"
+        )
+    failed = sum(1 for summary in summaries if summary["status"] != "ok")
+    lines.append(f"{len(summaries)} files ({failed} failed), {total_rows} rows in {elapsed:.2f}s")
+    return "\n".join(lines)
+
+
+def run(inputs, out_dir, workers=None, library_path=LIBRARY_PATH, master_path=MASTER_PATH, summary_path=None,
+        profile_path=None, consolidated=False, suggestions=0):
+    """
+    Entry point of `python -m app convert`. Returns the process exit code.
+    With `profile_path`, the files are converted in this process under
+    cProfile and the stats are written to that path.
+    """
+    paths = expand_inputs(inputs)
+    if not paths:
+        print("No pCon exports (.xlsx/.csv) found.")
+        return 1
+    try:
+        names = output_names(paths)
+    except ValueError as e:
+        print(e)
+        return 1
+    for path, name in names.items():
+        if os.path.basename(name) != os.path.splitext(os.path.basename(path))[0]:
+            print(f"Warning: another export has the same name as {path}; writing it to {name}")
+    start = time.perf_counter()
+    if profile_path:
+        with metrics.run("convert", profile=True, profile_path=profile_path) as run_metrics:
+            summaries = convert_many(paths, out_dir, 1, library_path, master_path, consolidated, suggestions)
+        print(run_metrics.profile_text)
+    else:
+        summaries = convert_many(paths, out_dir, workers, library_path, master_path, consolidated, suggestions)
+    elapsed = time.perf_counter() - start
+    print(format_summary(summaries, elapsed))
+    if summary_path:
+        with open(summary_path, "w", encoding="utf-8") as fh:
+            json.dump({"seconds": round(elapsed, 3), "files": summaries}, fh, indent=2)
+    return 0 if all(summary["status"] == "ok" for summary in summaries) else 2
@@ -0,0 +1,582 @@
+"""
+Benchmarks for the converter. Run e.g.:
+
+    python benchmarks.py cold-start
+    python benchmarks.py vectorized --sizes 1000 10000 100000
+    python benchmarks.py ingest --rows 20000
+    python benchmarks.py writers --rows 20000
+    python benchmarks.py suite --sizes 1000 10000 --out results.json
+    python benchmarks.py compare baseline.json results.json
+    python benchmarks.py suggestions --misses 500
+    python benchmarks.py startup
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import openpyxl
+
+import engine
+import refdata
+from ingest import read_user_articles
+from writers import BACKENDS, write_xlsx
+from lookup import fallback_keys, get_fallback_key
+from pipeline import library_key_columns
+from suggest import SuggestionIndex
+
+
+def _best_of(func, repeat):
+    """Returns the fastest wall time of `repeat` calls to `func`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+#####################
+# Cold start: XLSX parse vs. compiled snapshot
+#####################
+
+def bench_cold_start(repeat=3):
+    """
+    Compares loading each reference workbook through openpyxl with loading its
+    compiled snapshot. The snapshots are compiled into a temporary copy of the
+    workbooks so the working tree is left untouched.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for source, parse in ((refdata.LIBRARY_PATH, refdata.read_library), (refdata.MASTER_PATH, refdata.read_master)):
+            path = os.path.join(tmp, os.path.basename(source))
+            with open(source, "rb") as src, open(path, "wb") as dst:
+                dst.write(src.read())
+            refdata.compile_snapshot(path, parse)
+            digest = refdata.file_digest(path)
+            xlsx_seconds = _best_of(lambda: parse(path), repeat)
+            snapshot_seconds = _best_of(lambda: refdata.load_snapshot(path, digest), repeat)
+            results.append({
+                "file": os.path.basename(source),
+                "xlsx_seconds": round(xlsx_seconds, 4),
+                "snapshot_seconds": round(snapshot_seconds, 4),
+                "speedup": round(xlsx_seconds / snapshot_seconds, 1),
+            })
+    return results
+
+
+#####################
+# Fallback keys per distinct article and vectorized presentation lines vs. the row-wise versions
+#####################
+
+def synthetic_user_frame(n, df_library, seed=0, df_master=None):
+    """
+    Returns a preprocessed-style upload (ARTICLE_NO, QUANTITY, SHORT_TEXT,
+    VARIANT_TEXT) of `n` rows drawn from the Library keys, mixing exact,
+    dash-suffixed, "SPECIAL"-prefixed and unknown article numbers. With
+    `df_master`, the master data ITEM NO. keys are drawn from as well.
+    """
+    rng = np.random.default_rng(seed)
+    keys = df_library["EUR ITEM NO."].dropna().to_numpy()
+    if df_master is not None and "ITEM NO." in df_master.columns:
+        keys = np.concatenate([keys, df_master["ITEM NO."].dropna().to_numpy()])
+    keys = keys[rng.integers(0, len(keys), n)].astype(object)
+    kind = rng.integers(0, 4, n)
+    articles = np.where(kind == 1, keys + "-BLCK", keys)
+    articles = np.where(kind == 2, "SPECIAL " + keys, articles)
+    articles = np.where(kind == 3, "X" + keys, articles)
+    return pd.DataFrame({
+        "ARTICLE_NO": articles,
+        "QUANTITY": rng.integers(1, 10, n),
+        "SHORT_TEXT": [f"ITEM {i % 97}" for i in range(n)],
+        "VARIANT_TEXT": rng.choice(["", "LIGHT OPTION: OFF", "BASE COLOR: BLACK"], n),
+    })
+
+
+def _region_lookups(df_library):
+    """
+    One {item no.: product} dict per Library key column, EUR first, with the
+    GBP/APMEA/USD numbers normalized as text like the lookup index does.
+    """
+    lookups = []
+    for region, column in enumerate(library_key_columns(df_library)):
+        lookup_region = {}
+        for key, product in zip(df_library[column], df_library["PRODUCT"]):
+            if pd.isna(key):
+                continue
+            if region > 0:
+                key = str(int(key) if isinstance(key, float) and key.is_integer() else key).strip().upper()
+            lookup_region[key] = product
+        lookups.append(lookup_region)
+    return lookups
+
+
+def _presentation_lines_rowwise(df_user, df_library):
+    """
+    The original per-row presentation builder, kept as the parity reference,
+    with the four-region rules: an article (or its fallback key) is looked up
+    in the EUR, GBP, APMEA and USD columns in that order, so a fallback key
+    may match another region's column than the article itself.
+    """
+    lookups = _region_lookups(df_library)
+
+    def lookup_library(key):
+        for lookup_region in lookups:
+            if key in lookup_region:
+                return lookup_region[key]
+        return None
+
+    lines_info = []
+    for _, row in df_user.iterrows():
+        article_no = row["ARTICLE_NO"]
+        quantity = row["QUANTITY"]
+        short_text = row["SHORT_TEXT"]
+        variant_text = row["VARIANT_TEXT"]
+        product_match = lookup_library(article_no)
+        if not product_match:
+            product_match = lookup_library(get_fallback_key(article_no))
+        if product_match and "ALL COLORS" in product_match.upper():
+            product_match = None
+        if product_match:
+            sort_key = product_match
+            final_line = f"{quantity} X {product_match}"
+        else:
+            sort_key = short_text
+            if variant_text and variant_text != "LIGHT OPTION: OFF":
+                final_line = f"{quantity} X {short_text} - {variant_text}"
+            else:
+                final_line = f"{quantity} X {short_text}"
+        lines_info.append((sort_key.upper(), final_line.upper()))
+    lines_info.sort(key=lambda x: x[0])
+    return [line for _, line in lines_info]
+
+
+def _presentation_lines_vectorized(df_user, df_library):
+    return engine.build_presentation_lines(df_user, df_library)["LINE"].tolist()
+
+
+def bench_vectorized(sizes=(1000, 10000, 100000), repeat=3):
+    """
+    Times get_fallback_key via .apply against fallback_keys (one call per
+    distinct article), and the row-wise presentation builder against
+    build_presentation_lines, asserting that both versions produce identical
+    output at every size.
+    """
+    df_library = refdata.library_data()
+    results = []
+    for n in sizes:
+        df_user = synthetic_user_frame(n, df_library)
+        articles = df_user["ARTICLE_NO"]
+        assert articles.apply(get_fallback_key).tolist() == fallback_keys(articles).tolist()
+        assert _presentation_lines_rowwise(df_user, df_library) == _presentation_lines_vectorized(df_user, df_library)
+        results.append({
+            "rows": n,
+            "fallback_apply_s": round(_best_of(lambda: articles.apply(get_fallback_key), repeat), 4),
+            "fallback_keys_s": round(_best_of(lambda: fallback_keys(articles), repeat), 4),
+            "lines_rowwise_s": round(_best_of(lambda: _presentation_lines_rowwise(df_user, df_library), 1), 4),
+            "lines_vector_s": round(_best_of(lambda: _presentation_lines_vectorized(df_user, df_library), repeat), 4),
+        })
+    return results
+
+
+#####################
+# Upload ingestion: full read_excel/read_csv vs. streaming reader
+#####################
+
+EXPORT_WIDTH = 40
+
+
+def _export_rows(df_user):
+    """Yields pCon-like rows (EXPORT_WIDTH columns) carrying the upload's four columns."""
+    header = [f"Column {i}" for i in range(EXPORT_WIDTH)]
+    header[2], header[4], header[17], header[30] = "Short Text", "Variant Text", "Article No.", "Quantity"
+    yield [None] * EXPORT_WIDTH
+    yield header
+    for position, (article, quantity, short_text, variant_text) in enumerate(
+        df_user[["ARTICLE_NO", "QUANTITY", "SHORT_TEXT", "VARIANT_TEXT"]].itertuples(index=False), start=1
+    ):
+        row = [f"Filler {position}-{i}" for i in range(EXPORT_WIDTH)]
+        row[0], row[2], row[4], row[17], row[30] = position, short_text, variant_text or None, article, int(quantity)
+        yield row
+
+
+def write_synthetic_export(path, df_user):
+    """Writes `df_user` as a pCon export: an "Article List" workbook or a ';'-separated CSV."""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", encoding="utf-8", newline="") as fh:
+            writer = csv.writer(fh, delimiter=";")
+            for row in _export_rows(df_user):
+                writer.writerow(["" if value is None else value for value in row])
+        return path
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Article List")
+    for row in _export_rows(df_user):
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def _measure(func):
+    """
+    Returns (result, wall seconds, peak traced MB). The call is timed without
+    tracing and then repeated under tracemalloc, whose overhead would
+    otherwise dominate the timing.
+    """
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def _open_upload(path):
+    """Returns the file as an in-memory upload with a `.name`, like Streamlit's UploadedFile."""
+    with open(path, "rb") as fh:
+        upload = io.BytesIO(fh.read())
+    upload.name = os.path.basename(path)
+    return upload
+
+
+def bench_ingest(rows=20000):
+    """
+    Reads a large synthetic export (XLSX and CSV) with load_user_file +
+    preprocess_user_data and with the streaming read_user_articles, checks
+    that both give the same articles and reports wall time and peak memory.
+    """
+    df_library = refdata.library_data()
+    df_user = synthetic_user_frame(rows, df_library)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for extension in ("xlsx", "csv"):
+            path = write_synthetic_export(os.path.join(tmp, f"export.{extension}"), df_user)
+            full, full_s, full_mb = _measure(lambda: engine.preprocess_user_data(engine.load_user_file(_open_upload(path))))
+            streamed, stream_s, stream_mb = _measure(lambda: read_user_articles(_open_upload(path)))
+            assert full.reset_index(drop=True).astype(str).equals(streamed.astype(str))
+            results.append({
+                "format": extension,
+                "rows": rows,
+                "full_s": round(full_s, 3),
+                "full_peak_mb": round(full_mb, 1),
+                "streaming_s": round(stream_s, 3),
+                "streaming_peak_mb": round(stream_mb, 1),
+            })
+    return results
+
+
+#####################
+# XLSX writer backends: write time, peak RSS and content parity
+#####################
+
+def _write_one(backend, rows, path):
+    """
+    Builds the SKU mapping sheets for a synthetic upload and writes them with
+    one backend. Runs in a fresh process (see bench_writers) so ru_maxrss
+    reflects this backend only. Prints write time and RSS growth as JSON.
+    """
+    df_library, df_master = refdata.library_data(), refdata.master_data()
+    df_user = synthetic_user_frame(rows, df_library)
+    sheets = engine.build_sku_masterdata_sheets(df_user, df_library, df_master)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    buffer = write_xlsx(sheets, backend)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(path, "wb") as fh:
+        fh.write(buffer.getvalue())
+    print(json.dumps({
+        "backend": backend,
+        "rows_written": sum(len(df) for _, df, _ in sheets),
+        "write_s": round(elapsed, 3),
+        "peak_rss_growth_mb": round((rss_after - rss_before) / 1024, 1),
+        "size_kb": round(len(buffer.getvalue()) / 1024),
+    }))
+
+
+def _cell_values(path):
+    """Returns {sheet name: list of row tuples} of an XLSX file."""
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return {sheet.title: list(sheet.iter_rows(values_only=True)) for sheet in workbook.worksheets}
+    finally:
+        workbook.close()
+
+
+def bench_writers(rows=20000, backends=BACKENDS):
+    """
+    Writes the SKU mapping & masterdata workbook with every backend, each in
+    its own process, and checks that every cell value matches the default
+    openpyxl (pandas) output.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = None
+        for backend in backends:
+            path = os.path.join(tmp, f"{backend}.xlsx")
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_write-one", backend, str(rows), path],
+                capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                results.append({"backend": backend, "write_s": "failed: " + completed.stderr.strip().splitlines()[-1]})
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            values = _cell_values(path)
+            if reference is None:
+                reference = values
+            result["content_equal"] = values == reference
+            results.append(result)
+    return results
+
+
+#####################
+# Suite: per-function throughput and peak memory, saved for comparison
+#####################
+
+SUITE_STAGES = (
+    "load_user_file",
+    "preprocess_user_data",
+    "generate_presentation_word",
+    "generate_order_import_excel",
+    "generate_sku_masterdata_excel",
+)
+
+
+def _git_revision():
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return completed.stdout.strip() + (" (dirty)" if subprocess.run(
+            ["git", "diff", "--quiet", "HEAD"], capture_output=True).returncode else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(sizes=(1000, 10000), formats=("xlsx", "csv"), seed=0):
+    """
+    For every size and format, writes a synthetic pCon export (article
+    numbers from the Library and master data, with dash-suffixed, SPECIAL
+    and unknown variants) and times the five public conversion steps
+    separately. Each generator resolves the upload itself, as it does when
+    called on its own. Returns one row per (format, size, function) with
+    wall time, rows per second and peak traced memory.
+    """
+    df_library, df_master = refdata.library_data(), refdata.master_data()
+    steps = {
+        "load_user_file": lambda upload, raw, df_user: engine.load_user_file(upload()),
+        "preprocess_user_data": lambda upload, raw, df_user: engine.preprocess_user_data(raw),
+        "generate_presentation_word": lambda upload, raw, df_user: engine.generate_presentation_word(df_user, df_library),
+        "generate_order_import_excel": lambda upload, raw, df_user: engine.generate_order_import_excel(df_user),
+        "generate_sku_masterdata_excel": lambda upload, raw, df_user: engine.generate_sku_masterdata_excel(df_user, df_library, df_master),
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            synthetic = synthetic_user_frame(rows, df_library, seed, df_master)
+            for extension in formats:
+                path = write_synthetic_export(os.path.join(tmp, f"export-{rows}.{extension}"), synthetic)
+                upload = lambda: _open_upload(path)
+                raw = engine.load_user_file(upload())
+                df_user = engine.preprocess_user_data(raw)
+                for name in SUITE_STAGES:
+                    _, seconds, peak_mb = _measure(lambda: steps[name](upload, raw, df_user))
+                    results.append({
+                        "format": extension,
+                        "rows": rows,
+                        "function": name,
+                        "seconds": round(seconds, 4),
+                        "rows_per_s": round(rows / seconds) if seconds else None,
+                        "peak_mb": round(peak_mb, 1),
+                    })
+    return results
+
+
+def save_results(results, path, seed=0):
+    """Writes suite results with the environment they were measured in, so runs can be compared."""
+    payload = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": _git_revision(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "seed": seed,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(payload, fh, indent=2)
+
+
+def compare_results(baseline_path, current_path):
+    """
+    Lines up two saved suite runs by (format, rows, function) and returns
+    the times of both with the relative change (negative is faster).
+    """
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = {(r["format"], r["rows"], r["function"]): r for r in json.load(fh)["results"]}
+    with open(current_path, encoding="utf-8") as fh:
+        current = json.load(fh)["results"]
+    rows = []
+    for result in current:
+        before = baseline.get((result["format"], result["rows"], result["function"]))
+        if before is None:
+            continue
+        rows.append({
+            "format": result["format"],
+            "rows": result["rows"],
+            "function": result["function"],
+            "before_s": before["seconds"],
+            "after_s": result["seconds"],
+            "change": f"{(result['seconds'] / before['seconds'] - 1):+.1%}" if before["seconds"] else "",
+            "before_mb": before["peak_mb"],
+            "after_mb": result["peak_mb"],
+        })
+    return rows
+
+
+#####################
+# Near-match suggestions: trigram index build and lookup time
+#####################
+
+def bench_suggestions(misses=500, top=5, seed=0):
+    """
+    Builds the suggestion index over the reference data and looks up
+    `misses` unknown article numbers (Library keys with a typo) against it.
+    """
+    df_library, df_master = refdata.library_data(), refdata.master_data()
+    rng = np.random.default_rng(seed)
+    keys = df_library["EUR ITEM NO."].dropna().to_numpy()
+    articles = [key[:-1] + "X" for key in keys[rng.integers(0, len(keys), misses)]]
+    start = time.perf_counter()
+    index = SuggestionIndex(df_library, df_master)
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    found = [index.candidates(article, "", top) for article in articles]
+    query_s = time.perf_counter() - start
+    return [{
+        "misses": misses,
+        "indexed": len(index.library_items) + len(index.master_items) + len(index.products),
+        "build_s": round(build_s, 3),
+        "query_s": round(query_s, 3),
+        "ms_per_miss": round(1000 * query_s / max(misses, 1), 2),
+        "with_candidates": sum(1 for candidates in found if candidates),
+    }]
+
+
+#####################
+# Startup: import time and heavy libraries loaded per entry module
+#####################
+
+STARTUP_MODULES = ("lookup", "engine", "batch", "app")
+HEAVY_MODULES = ("streamlit", "docx", "openpyxl", "xlsxwriter")
+_STARTUP_PROBE = (
+    "import json, sys, time; start = time.perf_counter(); import {module}; "
+    "print(json.dumps({{'seconds': time.perf_counter() - start, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))"
+)
+
+
+def bench_startup(modules=STARTUP_MODULES, repeat=5):
+    """
+    Imports each entry module in a fresh interpreter and reports the fastest
+    import time and which heavy libraries it pulled in. Run it on two
+    revisions to compare startup before and after a change.
+    """
+    results = []
+    for module in modules:
+        timings, loaded = [], []
+        for _ in range(repeat):
+            completed = subprocess.run(
+                [sys.executable, "-c", _STARTUP_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            if completed.returncode != 0:
+                break
+            probe = json.loads(completed.stdout.strip().splitlines()[-1])
+            timings.append(probe["seconds"])
+            loaded = probe["loaded"]
+        if not timings:
+            results.append({"module": module, "import_s": "failed: " + completed.stderr.strip().splitlines()[-1], "loaded": ""})
+            continue
+        results.append({"module": module, "import_s": round(min(timings), 3), "loaded": ", ".join(loaded) or "-"})
+    return results
+
+
+def _print_rows(rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    widths = [max(len(str(c)), *(len(str(r[c])) for r in rows)) for c in columns]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converter benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cold = commands.add_parser("cold-start", help="XLSX parse vs. compiled snapshot load time.")
+    cold.add_argument("--repeat", type=int, default=3)
+    vectorized = commands.add_parser("vectorized", help="Row-wise vs. per-distinct fallback keys and vectorized presentation lines.")
+    vectorized.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    vectorized.add_argument("--repeat", type=int, default=3)
+    ingest = commands.add_parser("ingest", help="Full vs. streaming upload reader on a synthetic export.")
+    ingest.add_argument("--rows", type=int, default=20000)
+    writers = commands.add_parser("writers", help="Write time, peak RSS and content parity of the XLSX writer backends.")
+    writers.add_argument("--rows", type=int, default=20000)
+    suite = commands.add_parser("suite", help="Time the five conversion steps on synthetic exports and save the results.")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    suite.add_argument("--formats", nargs="+", choices=("xlsx", "csv"), default=["xlsx", "csv"])
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--out", default=None, help="Save the results as JSON to this path.")
+    compare = commands.add_parser("compare", help="Compare two saved suite runs.")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    suggestions = commands.add_parser("suggestions", help="Suggestion index build time and lookup time per unmatched article.")
+    suggestions.add_argument("--misses", type=int, default=500)
+    startup = commands.add_parser("startup", help="Import time and heavy libraries loaded per entry module.")
+    startup.add_argument("--modules", nargs="+", default=list(STARTUP_MODULES))
+    startup.add_argument("--repeat", type=int, default=5)
+    write_one = commands.add_parser("_write-one")
+    write_one.add_argument("backend")
+    write_one.add_argument("rows", type=int)
+    write_one.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "cold-start":
+        _print_rows(bench_cold_start(args.repeat))
+    elif args.command == "vectorized":
+        _print_rows(bench_vectorized(args.sizes, args.repeat))
+    elif args.command == "ingest":
+        _print_rows(bench_ingest(args.rows))
+    elif args.command == "writers":
+        _print_rows(bench_writers(args.rows))
+    elif args.command == "suite":
+        results = bench_suite(args.sizes, args.formats, args.seed)
+        _print_rows(results)
+        if args.out:
+            save_results(results, args.out, args.seed)
+    elif args.command == "compare":
+        _print_rows(compare_results(args.baseline, args.current))
+    elif args.command == "suggestions":
+        _print_rows(bench_suggestions(args.misses))
+    elif args.command == "startup":
+        _print_rows(bench_startup(args.modules, args.repeat))
+    elif args.command == "_write-one":
+        _write_one(args.backend, args.rows, args.path)
+
+
+if __name__ == "__main__":
+    main()
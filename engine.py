@@ -0,0 +1,564 @@
+"""
+The conversion engine: reference data loading, upload preprocessing and the
+three outputs (presentation list, order import file, SKU mapping &
+masterdata), shared by the Streamlit app, batch mode, the HTTP API and the
+benchmarks. It does not depend on Streamlit.
+
+python-docx, openpyxl/xlsxwriter (see writers) and the suggestion index are
+imported when an output that needs them is generated, so a process only loads
+the libraries of the outputs it writes: lookups load none of them, and order
+import files no python-docx.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from ingest import UploadError, articles_frame, read_export_frame, read_user_articles
+from lookup import fallback_keys
+from output_cache import OUTPUT_CACHE
+from pipeline import ResolvedUpload, resolve_upload
+from refdata import (
+    LIBRARY_KEY, LIBRARY_PATH, MASTER_KEY, MASTER_PATH, REFERENCE_CACHE, compact_frame, compile_reference_data, diff_frames,
+    library_data, master_columns, master_data, read_library, read_master
+)
+from writers import BACKENDS, WRITER_ENV, write_xlsx, writer_backend
+
+logger = logging.getLogger("converter.engine")
+
+_error_handler = logger.error
+
+def set_error_handler(handler):
+    """
+    Routes the user-facing error messages of the loaders and generators to
+    `handler` (e.g. st.error in the Streamlit app). They are logged on the
+    "converter.engine" logger by default.
+    """
+    global _error_handler
+    _error_handler = handler
+
+def _report_error(message):
+    _error_handler(message)
+
+#####################
+# 1. Data-load functions
+#####################
+
+def load_library_data(library_path=LIBRARY_PATH):
+    """
+    Loads Library_data.xlsx, trims and converts column names to uppercase.
+    Expected headers (in row 1) include:
+        - Product
+        - EUR item no.
+        - GBP item no.
+        - APMEA item no.
+        - USD pattern no.
+        - Match Status
+    The parsed frame is served from the process-wide reference cache and is
+    only re-parsed when the file changes.
+    """
+    if not os.path.exists(library_path):
+        _report_error(f"Filen {library_path} mangler i mappen. Upload eller placér filen korrekt.")
+        return None
+    try:
+        return library_data(library_path)
+    except Exception as e:
+        _report_error(f"Fejl ved indlæsning af {library_path}: {e}")
+        return None
+
+def load_master_data(master_path=MASTER_PATH):
+    """
+    Loads the entire master data file.
+    Expected unique lookup column: ITEM NO. (in column B).
+    Returns a DataFrame with all columns, served from the process-wide
+    reference cache.
+    """
+    if not os.path.exists(master_path):
+        _report_error(f"Filen {master_path} mangler i mappen. Upload eller placér filen korrekt.")
+        return None
+    try:
+        return master_data(master_path)
+    except Exception as e:
+        _report_error(f"Fejl ved indlæsning af {master_path}: {e}")
+        return None
+
+def load_user_file(uploaded_file):
+    """
+    Loads the user's uploaded file (pCon-export) with all its columns
+    (see ingest.read_export_frame).
+    - If Excel: looks for sheet "Article List", skips the first 2 rows, no header.
+    - If CSV: sniffs the delimiter (';' or ','), skiprows=2, header=None.
+    Returns a DataFrame (without column names) or None.
+    """
+    try:
+        return read_export_frame(uploaded_file)
+    except UploadError as e:
+        _report_error(str(e))
+        return None
+    except Exception as e:
+        _report_error(f"Fejl ved læsning af fil: {e}")
+        return None
+
+#####################
+# 2. Preprocessing of user data
+#####################
+
+def preprocess_user_data(df):
+    """
+    Extracts columns (by index):
+      - Index 17 -> ARTICLE_NO
+      - Index 30 -> QUANTITY
+      - Index 2  -> SHORT_TEXT
+      - Index 4  -> VARIANT_TEXT
+    Assumes the first 2 rows have been skipped.
+    Replaces NaN in VARIANT_TEXT with an empty string and drops rows without ARTICLE_NO.
+    """
+    if df.shape[1] < 31:
+        _report_error("Den uploadede fil indeholder ikke nok kolonner (mindst 31 kræves). Tjek format.")
+        return None
+
+    with metrics.stage("preprocess", rows=len(df)):
+        return articles_frame(df.iloc[:, 17], df.iloc[:, 30], df.iloc[:, 2], df.iloc[:, 4])
+
+#####################
+# 3. Product list for presentations (Word) - using fallback logic
+#####################
+
+def _as_text(values):
+    """Formats every value of a Series the way an f-string would (str() per value)."""
+    return pd.Series(np.asarray(values, dtype=object).astype(str), index=values.index, dtype=object)
+
+def build_presentation_lines(df_user, df_library, resolved=None):
+    """
+    Builds the presentation lines for the whole upload at once with
+    array-level operations (see generate_presentation_word for the rules).
+    Reuses the Library resolution of `resolved` (a ResolvedUpload) if given.
+    Returns a DataFrame with SORT_KEY and LINE (both uppercase), stably
+    sorted by SORT_KEY.
+    """
+    if resolved is None:
+        resolved = ResolvedUpload(df_user, df_library, None)
+    rows = resolved.library["ROW"]
+    product = pd.Series(resolved.library_index.column("PRODUCT", rows), index=df_user.index, dtype=object)
+    # Produkter der indeholder "ALL COLORS" ignoreres, så fallback-formateringen bruges
+    all_colors = product.str.upper().str.contains("ALL COLORS", regex=False, na=False)
+    has_product = product.notna() & (product != "") & ~all_colors
+
+    quantity = _as_text(df_user["QUANTITY"])
+    short_text = _as_text(df_user["SHORT_TEXT"])
+    variant_text = _as_text(df_user["VARIANT_TEXT"])
+    with_variant = (variant_text != "") & (variant_text != "LIGHT OPTION: OFF")
+    fallback_text = short_text + (" - " + variant_text).where(with_variant, "")
+
+    product_text = _as_text(product)
+    text = product_text.where(has_product, fallback_text)
+    lines = pd.DataFrame({
+        "SORT_KEY": product_text.where(has_product, short_text).str.upper(),
+        "LINE": (quantity + " X " + text).str.upper(),
+    })
+    return lines.sort_values("SORT_KEY", kind="stable")
+
+def generate_presentation_word(df_user, df_library, resolved=None):
+    """
+    For each row in df_user:
+      - Attempts a direct match between ARTICLE_NO and df_library's EUR ITEM NO.,
+        GBP ITEM NO., APMEA ITEM NO. or USD PATTERN NO. (in that order).
+      - If a direct match is found, outputs "QUANTITY X PRODUCT".
+      - If no direct match is found, computes a fallback key using get_fallback_key and tries to find a match.
+      - If a fallback match is found, outputs "QUANTITY X PRODUCT" using the fallback result.
+      - Otherwise, outputs "QUANTITY X SHORT_TEXT - VARIANT_TEXT" 
+        (omitting '- VARIANT_TEXT' if empty or equals "LIGHT OPTION: OFF").
+      Additionally, if the product text (from the "PRODUCT" column in library) contains "ALL COLORS",
+      the match is ignored and the fallback formatting is used.
+    The list is sorted alphabetically (case-insensitive) before generating a Word document.
+    Pass `resolved` (a ResolvedUpload) to reuse an existing match of the upload.
+    """
+    required_cols = ["PRODUCT", "EUR ITEM NO."]
+    for col in required_cols:
+        if col not in df_library.columns:
+            _report_error(f"Library_data mangler kolonnen '{col}'. Kan ikke generere præsentationsliste.")
+            return None
+
+    with metrics.stage("presentation_lines", rows=len(df_user)):
+        lines = build_presentation_lines(df_user, df_library, resolved)
+    from docx import Document
+
+    with metrics.stage("presentation_docx", rows=len(lines)):
+        buffer = BytesIO()
+        doc = Document()
+        doc.add_heading('Product List for Presentations', level=1)
+        for line_text in lines["LINE"]:
+            doc.add_paragraph(line_text)
+        doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+
+#####################
+# 4. Order import file (Excel with 2 columns, no header) - using fallback for ARTICLE_NO
+#####################
+
+def generate_order_import_excel(df_user, resolved=None):
+    """
+    Returns an Excel file (as BytesIO) with 2 columns (no headers):
+      - Column A: QUANTITY
+      - Column B: ARTICLE_NO (cleaned using fallback logic)
+    Written with the configured XLSX writer backend (see writers.writer_backend).
+    Pass `resolved` (a ResolvedUpload) to reuse its cleaned article numbers.
+    """
+    order_keys = resolved.order_keys if resolved is not None else fallback_keys(df_user["ARTICLE_NO"])
+    temp_df = pd.DataFrame({
+        "QUANTITY": df_user["QUANTITY"],
+        "ARTICLE_NO": order_keys
+    })
+    return write_xlsx([(None, temp_df, False)])
+
+#####################
+# 5. SKU mapping & Masterdata (with fallback and special-case handling)
+#####################
+
+def build_sku_masterdata_sheets(df_user, df_library, df_master, resolved=None, suggestions=0):
+    """
+    Builds the sheets of the SKU mapping & masterdata file:
+    
+    1) "Item number mapping":
+       - Attempts a direct match between df_user's ARTICLE_NO and Library_data's EUR ITEM NO.,
+         GBP ITEM NO., APMEA ITEM NO. or USD PATTERN NO. (in that order).
+       - If no direct match is found, computes a fallback key using get_fallback_key and attempts a match.
+       - Returns the following columns:
+           • Quantity in setting (from df_user's QUANTITY)
+           • Article No.
+           • Short Text
+           • Variant text (with NaN replaced by an empty string)
+           • Product in setting (from Library_data's Product)
+           • EUR item no.
+           • GBP item no.
+           • APMEA item no.
+           • USD pattern no.
+           • Match status
+           • Matched region (EUR, GBP, APMEA or USD: the column the article was found in)
+    
+    2) "Master data export":
+       - Attempts a direct match between df_user's ARTICLE_NO and masterdata's ITEM NO.
+       - If no direct match is found, computes a fallback key using get_fallback_key and attempts a match.
+       - Returns all columns from the masterdata file plus the df_user columns:
+         Article No., Short Text, and Variant text (with Variant text cleaned of NaN values).
+
+    3) "Suggestions" (only with `suggestions` > 0):
+       - For upload lines matching neither Library_data nor masterdata, the
+         `suggestions` closest item numbers and product names with their
+         scores (see suggest.suggest_unmatched).
+
+    Pass `resolved` (a ResolvedUpload) to reuse an existing match of the upload.
+    Returns a list of (sheet name, DataFrame, header) tuples for writers.write_xlsx.
+    """
+    if resolved is None:
+        resolved = ResolvedUpload(df_user, df_library, df_master)
+
+    # --- ITEM NUMBER MAPPING ---
+    rename_map = {
+        "PRODUCT": "LIB_PRODUCT",
+        "EUR ITEM NO.": "LIB_EUR_ITEM_NO",
+        "GBP ITEM NO.": "LIB_GBP_ITEM_NO",
+        "APMEA ITEM NO.": "LIB_APMEA_ITEM_NO",
+        "USD PATTERN NO.": "LIB_USD_PATTERN_NO",
+        "MATCH STATUS": "LIB_MATCH_STATUS"
+    }
+    if resolved.library is not None:
+        index = resolved.library_index
+        positions, rows = index.expand(resolved.library)
+        merged_direct = pd.concat([
+            df_user.iloc[positions].reset_index(drop=True),
+            index.take_filled(resolved.library, positions, rows).rename(columns=rename_map)
+        ], axis=1)
+        # "EUR ITEM NO." -> "EUR" etc.; empty when nothing matched
+        merged_direct["LIB_REGION"] = resolved.library["REGION"].str.split(" ").str[0].to_numpy()[positions]
+    else:
+        merged_direct = df_user.copy()
+    
+    merged_direct["VARIANT_TEXT"] = merged_direct["VARIANT_TEXT"].fillna("")
+    
+    item_number_mapping_df = pd.DataFrame({
+        "Quantity in setting": merged_direct["QUANTITY"],
+        "Article No.": merged_direct["ARTICLE_NO"],
+        "Short Text": merged_direct["SHORT_TEXT"],
+        "Variant text": merged_direct["VARIANT_TEXT"].fillna(""),
+        "Product in setting": merged_direct.get("LIB_PRODUCT", None),
+        "EUR item no.": merged_direct.get("LIB_EUR_ITEM_NO", None),
+        "GBP item no.": merged_direct.get("LIB_GBP_ITEM_NO", None),
+        "APMEA item no.": merged_direct.get("LIB_APMEA_ITEM_NO", None),
+        "USD pattern no.": merged_direct.get("LIB_USD_PATTERN_NO", None),
+        "Match status": merged_direct.get("LIB_MATCH_STATUS", None),
+        "Matched region": merged_direct.get("LIB_REGION", None)
+    })
+    item_number_mapping_df = item_number_mapping_df[item_number_mapping_df["Article No."].astype(bool)]
+    
+    # --- MASTER DATA EXPORT ---
+    if resolved.master is None:
+        master_data_export_df = pd.DataFrame(columns=["Article No.", "Short Text", "Variant text"] + df_master.columns.tolist())
+    else:
+        # Identical upload lines give identical export rows, so only the first
+        # of each is fanned out over the master rows before drop_duplicates.
+        first = ~df_user.duplicated().to_numpy()
+        user_rows = df_user[first]
+        index = resolved.master_index
+        positions, rows = index.expand(resolved.master[first])
+        master_direct = pd.concat([
+            user_rows.iloc[positions].reset_index(drop=True),
+            index.take_filled(resolved.master[first], positions, rows)
+        ], axis=1)
+        master_direct.drop_duplicates(inplace=True)
+        master_direct.rename(columns={
+            "ARTICLE_NO": "Article No.",
+            "SHORT_TEXT": "Short Text",
+            "VARIANT_TEXT": "Variant text"
+        }, inplace=True)
+        master_direct["Variant text"] = master_direct["Variant text"].fillna("")
+        front_cols = ["Article No.", "Short Text", "Variant text"]
+        other_cols = [c for c in master_direct.columns if c not in front_cols]
+        master_data_export_df = master_direct[front_cols + other_cols]
+        master_data_export_df = master_data_export_df[master_data_export_df["Article No."].astype(bool)]
+    
+    sheets = [
+        ("Item number mapping", item_number_mapping_df, True),
+        ("Master data export", master_data_export_df, True)
+    ]
+    if suggestions:
+        from suggest import suggest_unmatched
+        sheets.append(("Suggestions", suggest_unmatched(resolved, suggestions), True))
+    return sheets
+
+def generate_sku_masterdata_excel(df_user, df_library, df_master, resolved=None, suggestions=0):
+    """
+    Writes the sheets of build_sku_masterdata_sheets ("Item number mapping",
+    "Master data export" and optionally "Suggestions") to an Excel file (as
+    BytesIO), using the configured XLSX writer backend (see writers.writer_backend).
+    """
+    with metrics.stage("sku_merge", rows=len(df_user)):
+        sheets = build_sku_masterdata_sheets(df_user, df_library, df_master, resolved, suggestions)
+    return write_xlsx(sheets)
+
+#####################
+# 6. All outputs from one shared resolution pass
+#####################
+
+OUTPUT_FILE_NAMES = {
+    "presentation": "product-list.docx",
+    "order_import": "order-import.xlsx",
+    "sku_masterdata": "SKUmapping-masterdata.xlsx",
+}
+
+def read_upload(uploaded_file):
+    """
+    Reads and preprocesses an uploaded pCon export in one streaming pass
+    (see ingest.read_user_articles). Returns the preprocessed DataFrame or None.
+    """
+    try:
+        with metrics.stage("read_upload") as record:
+            df_user = read_user_articles(uploaded_file)
+            record["rows"] = len(df_user)
+        return df_user
+    except UploadError as e:
+        _report_error(str(e))
+        return None
+    except Exception as e:
+        _report_error(f"Fejl ved læsning af fil: {e}")
+        return None
+
+def resolve_uploaded_file(uploaded_file, df_library, df_master):
+    """
+    Matches an uploaded file against the reference data once, memoized per
+    upload content hash (see pipeline.resolve_upload). Returns a ResolvedUpload or None.
+    """
+    upload_digest = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+
+    def read():
+        # Its own run, recorded only when the upload is actually read (not on every rerun)
+        with metrics.run(f"{uploaded_file.name}: read"):
+            return read_upload(uploaded_file)
+
+    return resolve_upload(upload_digest, df_library, df_master, read)
+
+def output_key(resolved, output_type, options):
+    """
+    Identifies one generated file by content: the upload content hash, the
+    Library and master data versions (file hashes, and the master columns
+    kept by CONVERTER_MASTER_COLUMNS), the output type, the options that
+    change the file and the XLSX writer. Returns None when the
+    upload or the reference data has no known version. Unlike object ids,
+    which CPython reuses once an object is freed, the key cannot end up
+    pointing at another upload or reference-data version.
+    """
+    return upload_output_key(resolved.upload_digest, resolved.df_library, resolved.df_master, output_type, options)
+
+def upload_output_key(upload_digest, df_library, df_master, output_type, options):
+    """`output_key` before the upload is read: from its content hash and the reference frames it will be matched against."""
+    library_version = REFERENCE_CACHE.version_of(df_library)
+    master_version = REFERENCE_CACHE.version_of(df_master)
+    if upload_digest is None or library_version is None or master_version is None:
+        return None
+    # The cached master frame also depends on CONVERTER_MASTER_COLUMNS, which
+    # changes the master data sheet; the disk cache is shared between processes
+    master_version = (master_version, master_columns())
+    return (upload_digest, library_version, master_version, output_type, options, writer_backend())
+
+def cached_output(resolved, output_type, options, build):
+    """
+    Returns the file `build()` generates for an upload from the shared
+    output cache, keyed by `output_key`. Uploads without a known version
+    are always built.
+    """
+    key = output_key(resolved, output_type, options)
+    if key is None:
+        return build()
+    return OUTPUT_CACHE.get_or_build(key, build)
+
+def generate_all_outputs(resolved, consolidated=False, suggestions=0):
+    """
+    Renders the presentation list, the order import file and the SKU mapping
+    from one ResolvedUpload. Returns a dict {file name: BytesIO}; outputs that
+    could not be generated are left out.
+    With `consolidated`, the presentation list and the order import file get
+    one line per distinct article with the summed quantity; the SKU mapping
+    always keeps one line per upload row. With `suggestions`, the SKU
+    mapping gets a "Suggestions" sheet (see build_sku_masterdata_sheets).
+    """
+    # The per-kind builders of OUTPUTS, so the cache keys and options match
+    # the files generated one at a time
+    outputs = {}
+    for kind, file_name in OUTPUT_FILE_NAMES.items():
+        buffer = OUTPUTS[kind][2](resolved, consolidated, suggestions)
+        if buffer is not None:
+            outputs[file_name] = buffer
+    return outputs
+
+def generate_zip(outputs):
+    """Packs a {file name: BytesIO} dict into one zip file (as BytesIO)."""
+    buffer = BytesIO()
+    with metrics.stage("zip", rows=len(outputs)), zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, file_buffer in outputs.items():
+            archive.writestr(name, file_buffer.getvalue())
+    buffer.seek(0)
+    return buffer
+
+#####################
+# 7. Output builders by kind
+#####################
+
+def _output_lines(resolved, consolidated):
+    return resolved.consolidated if consolidated else resolved
+
+def _build_presentation(resolved, consolidated, suggestions):
+    def build():
+        lines = _output_lines(resolved, consolidated)
+        return generate_presentation_word(lines.df_user, resolved.df_library, lines)
+    return cached_output(resolved, "presentation", (consolidated,), build)
+
+def _build_order_import(resolved, consolidated, suggestions):
+    def build():
+        lines = _output_lines(resolved, consolidated)
+        return generate_order_import_excel(lines.df_user, lines)
+    return cached_output(resolved, "order_import", (consolidated,), build)
+
+def _build_sku_masterdata(resolved, consolidated, suggestions):
+    return cached_output(resolved, "sku_masterdata", (suggestions,),
+                         lambda: generate_sku_masterdata_excel(resolved.df_user, resolved.df_library, resolved.df_master, resolved, suggestions))
+
+def _build_zip(resolved, consolidated, suggestions):
+    return cached_output(resolved, "zip", (consolidated, suggestions),
+                         lambda: generate_zip(generate_all_outputs(resolved, consolidated, suggestions)))
+
+# Output kind -> (file name, expected stages, builder(resolved, consolidated, suggestions))
+OUTPUTS = {
+    "presentation": (OUTPUT_FILE_NAMES["presentation"], 3, _build_presentation),
+    "order_import": (OUTPUT_FILE_NAMES["order_import"], 1, _build_order_import),
+    "sku_masterdata": (OUTPUT_FILE_NAMES["sku_masterdata"], 4, _build_sku_masterdata),
+    "all": ("pcon-outputs.zip", 8, _build_zip),
+}
+
+#####################
+# 8. Command line
+#####################
+
+def cli(argv):
+    """
+    Headless commands, e.g. `python -m app compile`:
+      - compile: writes snapshots of the reference workbooks for fast cold starts.
+      - convert: converts a directory or glob of pCon exports into the three outputs each.
+      - diff: prints the SKUs added, removed and changed between two reference workbooks.
+      - memory: prints the master data memory per column before and after compaction.
+      - serve: runs the local HTTP conversion API (see api.ConversionApi).
+    The same commands run without Streamlit as `python -m engine ...`.
+    """
+    parser = argparse.ArgumentParser(prog="python -m app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_cmd = commands.add_parser("compile", help="Compile the reference workbooks into snapshots.")
+    compile_cmd.add_argument("--library", default=LIBRARY_PATH)
+    compile_cmd.add_argument("--master", default=MASTER_PATH)
+
+    convert_cmd = commands.add_parser("convert", help="Convert many pCon exports in parallel.")
+    convert_cmd.add_argument("inputs", nargs="+", help="Files, directories or glob patterns of pCon exports.")
+    convert_cmd.add_argument("--out", default="converted", help="Output directory (one sub-directory per file).")
+    convert_cmd.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    convert_cmd.add_argument("--summary", default=None, help="Also write the per-file summary as JSON to this path.")
+    convert_cmd.add_argument("--consolidate", action="store_true", help="One line per distinct article in the presentation list and order import.")
+    convert_cmd.add_argument("--suggestions", type=int, default=0, metavar="N", help="Add the N closest candidates for unmatched articles to the SKU mapping.")
+    convert_cmd.add_argument("--profile", default=None, help="Convert in one process under cProfile and write the stats to this path.")
+    convert_cmd.add_argument("--xlsx-writer", choices=BACKENDS, default=None, help=f"XLSX writer backend (default: ${WRITER_ENV} or openpyxl).")
+    convert_cmd.add_argument("--library", default=LIBRARY_PATH)
+    convert_cmd.add_argument("--master", default=MASTER_PATH)
+
+    diff_cmd = commands.add_parser("diff", help="Report the SKUs added, removed and changed between two reference workbooks.")
+    diff_cmd.add_argument("old")
+    diff_cmd.add_argument("new")
+    diff_cmd.add_argument("--library", action="store_true", help="Compare Library workbooks (EUR ITEM NO.) instead of master data (ITEM NO.).")
+
+    memory_cmd = commands.add_parser("memory", help="Master data memory per column before and after compaction.")
+    memory_cmd.add_argument("--master", default=MASTER_PATH)
+    memory_cmd.add_argument("--columns", nargs="*", default=None, help="Only keep these columns (plus ITEM NO.).")
+
+    serve_cmd = commands.add_parser("serve", help="Run the local HTTP conversion API.")
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", type=int, default=8765)
+    serve_cmd.add_argument("--workers", type=int, default=None, help="Concurrent conversions (default: $CONVERTER_JOB_WORKERS or 2).")
+    serve_cmd.add_argument("--library", default=LIBRARY_PATH)
+    serve_cmd.add_argument("--master", default=MASTER_PATH)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        import api
+        return api.serve(args.host, args.port, args.workers, args.library, args.master)
+    elif args.command == "memory":
+        _, report = compact_frame(read_master(args.master), MASTER_KEY, args.columns)
+        print(f"{'column':40}  {'dtype':10}  {'before MB':>10}  {'after MB':>10}")
+        for column, usage in report["columns"].items():
+            print(f"{column[:40]:40}  {usage['dtype'][:10]:10}  {usage['before_mb']:>10.3f}  {usage['after_mb']:>10.3f}")
+        print(f"{'total':40}  {'':10}  {report['before_mb']:>10.3f}  {report['after_mb']:>10.3f}")
+    elif args.command == "diff":
+        parse, key_column = (read_library, LIBRARY_KEY) if args.library else (read_master, MASTER_KEY)
+        changes = diff_frames(parse(args.old), parse(args.new), key_column)
+        print(json.dumps(changes, indent=2, ensure_ascii=False))
+    elif args.command == "compile":
+        for path in compile_reference_data(args.library, args.master):
+            print(f"Wrote {path}")
+    elif args.command == "convert":
+        if args.xlsx_writer:
+            # Set in the environment so the worker processes pick it up too
+            os.environ[WRITER_ENV] = args.xlsx_writer
+        import batch
+        return batch.run(args.inputs, args.out, args.workers, args.library, args.master, args.summary, args.profile,
+                         args.consolidate, args.suggestions)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(cli(sys.argv[1:]))
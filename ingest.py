@@ -0,0 +1,181 @@
+import csv
+
+import pandas as pd
+
+#####################
+# Upload ingestion (pCon "Article List" exports)
+#####################
+
+ARTICLE_SHEET = "Article List"
+SKIP_ROWS = 2
+MIN_COLUMNS = 31
+# Column index in the pCon export -> column name in the preprocessed frame
+USER_COLUMNS = {17: "ARTICLE_NO", 30: "QUANTITY", 2: "SHORT_TEXT", 4: "VARIANT_TEXT"}
+CHUNK_SIZE = 5000
+
+
+class UploadError(ValueError):
+    """Raised when an upload is not a readable pCon export. The message is shown to the user."""
+
+
+def articles_frame(article_no, quantity, short_text, variant_text):
+    """
+    Builds the preprocessed upload from the four pCon columns:
+      - ARTICLE_NO, SHORT_TEXT: stripped, uppercase
+      - VARIANT_TEXT: NaN replaced with "", stripped, uppercase
+      - QUANTITY: unchanged
+    Rows without an article number are dropped.
+    """
+    out_df = pd.DataFrame({
+        "ARTICLE_NO": article_no.astype(str).str.strip().str.upper(),
+        "QUANTITY": quantity,
+        "SHORT_TEXT": short_text.astype(str).str.strip().str.upper(),
+        "VARIANT_TEXT": variant_text.fillna("").astype(str).str.strip().str.upper()
+    })
+    out_df = out_df[article_no.notna() & out_df["ARTICLE_NO"].astype(bool)]
+    return out_df
+
+
+def consolidate_articles(df_user):
+    """
+    Collapses upload rows with the same ARTICLE_NO, SHORT_TEXT and
+    VARIANT_TEXT into one row, summing QUANTITY (pCon lists a product once
+    per placed item). Rows keep the order of their first occurrence.
+    Non-numeric quantities count as missing.
+    """
+    keys = ["ARTICLE_NO", "SHORT_TEXT", "VARIANT_TEXT"]
+    quantity = pd.to_numeric(df_user["QUANTITY"], errors="coerce")
+    grouped = quantity.groupby([df_user[key] for key in keys], sort=False).sum(min_count=1)
+    out_df = grouped.reset_index()
+    if out_df["QUANTITY"].notna().all() and (out_df["QUANTITY"] % 1 == 0).all():
+        out_df["QUANTITY"] = out_df["QUANTITY"].astype("int64")
+    return out_df[list(USER_COLUMNS.values())]
+
+
+def _finish(chunks):
+    columns = list(USER_COLUMNS.values())
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)[columns]
+
+
+def _chunk_frame(rows):
+    """Turns picked (short, variant, article, quantity) tuples into a preprocessed chunk."""
+    raw = pd.DataFrame(rows, columns=["SHORT_TEXT", "VARIANT_TEXT", "ARTICLE_NO", "QUANTITY"], dtype=object)
+    return articles_frame(raw["ARTICLE_NO"], raw["QUANTITY"].infer_objects(), raw["SHORT_TEXT"], raw["VARIANT_TEXT"])
+
+
+def read_xlsx_articles(file, chunk_size=CHUNK_SIZE):
+    """
+    Streams the "Article List" sheet with openpyxl in read-only mode, keeping
+    only the four needed columns and preprocessing them chunk by chunk, so the
+    other columns of the export are never materialized.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        if ARTICLE_SHEET not in workbook.sheetnames:
+            raise UploadError(f"Filen indeholder ikke en fane ved navn '{ARTICLE_SHEET}'.")
+        sheet = workbook[ARTICLE_SHEET]
+        width = 0
+        rows, chunks = [], []
+        for row in sheet.iter_rows(min_row=SKIP_ROWS + 1, values_only=True):
+            if len(row) > width:
+                width = len(row)
+            if len(row) < MIN_COLUMNS:
+                row = tuple(row) + (None,) * (MIN_COLUMNS - len(row))
+            rows.append((row[2], row[4], row[17], row[30]))
+            if len(rows) >= chunk_size:
+                chunks.append(_chunk_frame(rows))
+                rows = []
+        if rows:
+            chunks.append(_chunk_frame(rows))
+    finally:
+        workbook.close()
+    if width < MIN_COLUMNS:
+        raise UploadError("Den uploadede fil indeholder ikke nok kolonner (mindst 31 kræves). Tjek format.")
+    return _finish(chunks)
+
+
+def sniff_delimiter(sample):
+    """Returns ';' or ',' for a CSV text sample, preferring ';' like the pCon export does."""
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=";,").delimiter
+    except csv.Error:
+        return ";" if sample.count(";") >= sample.count(",") else ","
+
+
+def _csv_delimiter(file):
+    """Sniffs the delimiter of a CSV export from its first 64 KB (after the skipped rows) and rewinds."""
+    sample = file.read(64 * 1024)
+    if isinstance(sample, bytes):
+        sample = sample.decode("utf-8", errors="replace")
+    file.seek(0)
+    return sniff_delimiter("\n".join(sample.splitlines()[SKIP_ROWS:]) or sample)
+
+
+def read_csv_articles(file, chunk_size=CHUNK_SIZE):
+    """
+    Reads a CSV export with the C parser and a sniffed delimiter, parsing only
+    the four needed columns in chunks. Article numbers and texts are read as
+    text, so leading zeros are kept.
+    """
+    try:
+        reader = pd.read_csv(
+            file,
+            sep=_csv_delimiter(file),
+            engine="c",
+            header=None,
+            skiprows=SKIP_ROWS,
+            usecols=list(USER_COLUMNS),
+            dtype={2: object, 4: object, 17: object},
+            chunksize=chunk_size,
+        )
+        chunks = [
+            articles_frame(chunk[17], chunk[30], chunk[2], chunk[4])
+            for chunk in reader
+        ]
+    except ValueError as e:
+        if "usecols" in str(e).lower():
+            raise UploadError("Den uploadede fil indeholder ikke nok kolonner (mindst 31 kræves). Tjek format.")
+        raise
+    return _finish(chunks)
+
+
+def read_user_articles(uploaded_file, chunk_size=CHUNK_SIZE):
+    """
+    Streaming, low-memory alternative to load_user_file + preprocess_user_data:
+    reads an uploaded pCon export (Excel with an "Article List" sheet or CSV)
+    and returns the preprocessed frame (ARTICLE_NO, QUANTITY, SHORT_TEXT,
+    VARIANT_TEXT) directly. Raises UploadError for files that are not a
+    readable pCon export.
+    """
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    file_name = getattr(uploaded_file, "name", "").lower()
+    if file_name.endswith(".csv"):
+        return read_csv_articles(uploaded_file, chunk_size)
+    return read_xlsx_articles(uploaded_file, chunk_size)
+
+
+def read_export_frame(uploaded_file):
+    """
+    Reads every column of an uploaded pCon export (the "Article List" sheet
+    or a CSV with a sniffed delimiter), skipping the first 2 rows, into a
+    DataFrame without column names, for callers that need more than the
+    four columns read_user_articles keeps. The article and text columns are
+    read as text, as read_user_articles does. Raises UploadError when an
+    Excel file has no "Article List" sheet.
+    """
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    file_name = getattr(uploaded_file, "name", "").lower()
+    text_columns = {column: object for column in (2, 4, 17)}
+    if file_name.endswith(".csv"):
+        return pd.read_csv(uploaded_file, sep=_csv_delimiter(uploaded_file), engine="c",
+                           header=None, skiprows=SKIP_ROWS, dtype=text_columns)
+    excel = pd.ExcelFile(uploaded_file, engine="openpyxl")
+    if ARTICLE_SHEET not in excel.sheet_names:
+        raise UploadError(f"Filen indeholder ikke en fane ved navn '{ARTICLE_SHEET}'.")
+    return pd.read_excel(excel, sheet_name=ARTICLE_SHEET, skiprows=SKIP_ROWS, header=None, dtype=text_columns)
@@ -0,0 +1,188 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+#####################
+# Background report generation
+#####################
+
+JOB_WORKERS_ENV = "CONVERTER_JOB_WORKERS"
+JOB_TTL_SECONDS = 30 * 60
+MAX_JOBS = 64
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """
+    One report generation running in the background. Its stages are recorded
+    in `metrics` (see metrics.run), which is also how progress is reported
+    and how a cancel request reaches the running code: the next stage that
+    starts raises metrics.RunCancelled.
+
+    Jobs are shared by everyone who submits the same work (see
+    JobRunner.submit), so each submitter is recorded as an owner and the job
+    is only cancelled once every owner has cancelled it.
+    """
+
+    def __init__(self, job_id, key, label, expected_stages, profile=False):
+        self.id = job_id
+        self.key = key
+        self.label = label
+        self.expected_stages = expected_stages
+        self.profile = profile
+        self.metrics = metrics.RunMetrics(label)
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._owners = set()
+        self._owners_lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def wait(self, timeout=None):
+        """Blocks until the job finished (or `timeout` seconds passed); returns whether it finished."""
+        return self._done.wait(timeout)
+
+    def attach(self, owner):
+        """Records `owner` (e.g. a browser session) as interested in this job."""
+        if owner is not None:
+            with self._owners_lock:
+                self._owners.add(owner)
+
+    def cancel(self, owner=None):
+        """
+        Withdraws `owner`'s interest; the job is cancelled when no owner is
+        left. Without an owner, the job is cancelled right away.
+        """
+        with self._owners_lock:
+            self._owners.discard(owner)
+            if self._owners and owner is not None:
+                return
+        if not self.finished:
+            self.metrics.cancel()
+
+    def progress(self):
+        """
+        Returns the status, the running (or last finished) stage, the rows it
+        processes and the fraction done, estimated from the finished stages
+        against `expected_stages`.
+        """
+        stage = self.metrics.active_stage or (self.metrics.stages[-1] if self.metrics.stages else None)
+        if self.status == DONE:
+            fraction = 1.0
+        else:
+            fraction = min(len(self.metrics.stages) / max(self.expected_stages, 1), 0.95)
+        return {
+            "status": self.status,
+            "stage": stage["stage"] if stage else None,
+            "rows": stage["rows"] if stage else None,
+            "fraction": round(fraction, 2),
+        }
+
+    def _run(self, func):
+        if self.metrics.cancelled:
+            self._finish(CANCELLED)
+            return
+        self.status = RUNNING
+        try:
+            with metrics.run(self.label, profile=self.profile, metrics=self.metrics):
+                result = func()
+        except metrics.RunCancelled:
+            self._finish(CANCELLED)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.exception = e
+            self._finish(FAILED)
+        else:
+            if result is None:
+                self.error = "Filen kunne ikke genereres."
+                self._finish(FAILED)
+            else:
+                self.result = result
+                self._finish(DONE)
+
+    def _finish(self, status):
+        self.finished_at = time.time()
+        self.status = status
+        self._done.set()
+
+
+class JobRunner:
+    """
+    Process-wide background executor for report generation, shared by all
+    sessions. Jobs are deduplicated by key: submitting work that is already
+    queued, running or finished returns the existing job instead of starting
+    it again. Finished jobs are dropped after JOB_TTL_SECONDS, and the oldest
+    finished ones once there are more than MAX_JOBS.
+    """
+
+    def __init__(self, workers=None):
+        workers = workers or int(os.environ.get(JOB_WORKERS_ENV) or 2)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="converter-job")
+        self._jobs = {}
+        self._by_key = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, key, label, func, expected_stages=1, profile=False, owner=None):
+        """
+        Runs `func()` in the background (or reuses the job for `key`) and
+        returns the Job, with `owner` recorded as one of its owners (see
+        Job.cancel). With `profile`, the job runs under cProfile (see
+        metrics.run) and the report ends up in `job.metrics.profile_text`.
+        """
+        with self._lock:
+            self._prune()
+            job = self._by_key.get(key)
+            if job is not None and job.status not in (FAILED, CANCELLED) and not job.metrics.cancelled:
+                job.attach(owner)
+                return job
+            job = Job(f"job-{next(self._ids)}", key, label, expected_stages, profile)
+            job.attach(owner)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+        self._executor.submit(job._run, func)
+        return job
+
+    def get(self, job_id):
+        """Returns the job with this id, or None if it is unknown or expired."""
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        """Returns the number of known jobs per status."""
+        counts = {}
+        for job in list(self._jobs.values()):
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def _prune(self):
+        now = time.time()
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished),
+            key=lambda job: job.finished_at,
+        )
+        excess = len(self._jobs) - MAX_JOBS
+        for job in finished:
+            if now - job.finished_at > JOB_TTL_SECONDS or excess > 0:
+                excess -= 1
+                del self._jobs[job.id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+
+JOBS = JobRunner()
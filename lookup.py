@@ -0,0 +1,275 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+#####################
+# Fallback key generation
+#####################
+
+def get_fallback_key(article):
+    """
+    Returns a fallback key for an article number.
+    First, splits the article on '-' and takes the first segment.
+    Then, if that segment starts with "SPECIAL", removes the "SPECIAL" prefix and any leading spaces.
+    Returns the cleaned key in uppercase.
+    """
+    article = article.strip()
+    key = article.split('-')[0].strip().upper()
+    if key.startswith("SPECIAL"):
+        key = key[len("SPECIAL"):].strip().upper()
+    return key
+
+
+def fallback_keys(articles):
+    """
+    `get_fallback_key` for a whole Series of article numbers, called once per
+    distinct article and mapped back, since uploads repeat the same articles.
+    Missing values stay missing.
+    """
+    distinct = pd.unique(articles.dropna().to_numpy())
+    keys = pd.Series([get_fallback_key(article) for article in distinct], index=distinct, dtype=object)
+    # Keep the input dtype: pandas 3 would infer its string dtype here, whose
+    # isin against the object-keyed lookup index is far slower
+    return articles.map(keys).astype(articles.dtype)
+
+#####################
+# Article number lookup index
+#####################
+
+MATCH_DIRECT = "direct"
+MATCH_FALLBACK = "fallback"
+MATCH_NONE = ""
+
+
+def _region_keys(values):
+    """
+    Normalizes a secondary key column like the readers normalize the primary
+    one: text stripped and uppercase, whole numbers without a decimal part
+    (e.g. a USD pattern no. read as 12345.0), missing values kept missing.
+    """
+    def normalize(value):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip().upper()
+    return values.map(normalize, na_action="ignore")
+
+
+def _key_pairs(frame, key_columns, start=0):
+    """
+    Returns a (KEY, ROW, REGION) frame of the non-missing keys of every key
+    column, where REGION is the position of the column in `key_columns` and
+    ROW is offset by `start`.
+    """
+    parts = []
+    for region, column in enumerate(key_columns):
+        keys = frame[column] if region == 0 else _region_keys(frame[column])
+        valid = keys.notna().to_numpy()
+        parts.append(pd.DataFrame({
+            "KEY": keys.to_numpy()[valid],
+            "ROW": np.flatnonzero(valid) + start,
+            "REGION": np.full(int(valid.sum()), region, dtype=np.int8),
+        }))
+    return pd.concat(parts, ignore_index=True)
+
+
+class ArticleIndex:
+    """
+    Lookup index from article numbers to row positions in one reference table
+    (Library data on its regional item numbers or master data on ITEM NO.).
+
+    `key_column` is one column or a tuple of columns in priority order, e.g.
+    EUR, GBP, APMEA item no. and USD pattern no.: one index over all of them,
+    so an upload in any region is resolved in the same single pass. The first
+    column is expected to be normalized by the reader; the others are
+    normalized here.
+
+    Built once per reference-data version (see `article_index`) and shared by
+    all generators, so an upload is resolved with a couple of vectorized
+    lookups instead of a merge per generator and per key type.
+    """
+
+    def __init__(self, frame, key_column):
+        if not isinstance(frame.index, pd.RangeIndex) or frame.index.start != 0 or frame.index.step != 1:
+            frame = frame.reset_index(drop=True)
+        self.frame = frame
+        self.key_column = key_column
+        self._set_pairs(_key_pairs(frame, self.key_columns))
+
+    @property
+    def key_columns(self):
+        return self.key_column if isinstance(self.key_column, tuple) else (self.key_column,)
+
+    def _set_pairs(self, pairs):
+        # Every (key, row, region) triple, used to fan out like a left merge does.
+        self._pairs = pairs
+        # The last row per key and region, like `set_index(key).to_dict()`
+        # keeps; a key found in several regions resolves to the first region.
+        last = pairs.drop_duplicates(["KEY", "REGION"], keep="last")
+        last = last.sort_values("REGION", kind="stable").drop_duplicates("KEY", keep="first")
+        known = pd.Index(last["KEY"].to_numpy())
+        self._last_row = pd.Series(last["ROW"].to_numpy(), index=known)
+        self._region = pd.Series(last["REGION"].to_numpy(), index=known)
+
+    def patched(self, frame, kept):
+        """
+        Returns the index of `frame` without rescanning the rows this index
+        already covers. `frame` must consist of this table's rows where the
+        boolean array `kept` is True (in their original order), followed by
+        the new rows, as built by refdata.apply_changes.
+        """
+        kept = np.asarray(kept, dtype=bool)
+        new_position = np.cumsum(kept) - 1
+        old_rows = self._pairs["ROW"].to_numpy()
+        keep_pair = kept[old_rows]
+        start = int(kept.sum())
+        pairs = pd.concat(
+            [
+                pd.DataFrame({
+                    "KEY": self._pairs["KEY"].to_numpy()[keep_pair],
+                    "ROW": new_position[old_rows[keep_pair]],
+                    "REGION": self._pairs["REGION"].to_numpy()[keep_pair],
+                }),
+                _key_pairs(frame.iloc[start:], self.key_columns, start),
+            ],
+            ignore_index=True,
+        )
+        index = ArticleIndex.__new__(ArticleIndex)
+        index.frame = frame
+        index.key_column = self.key_column
+        index._set_pairs(pairs)
+        return index
+
+    def __len__(self):
+        return len(self.frame)
+
+    def resolve(self, articles):
+        """
+        Resolves a whole series of article numbers at once.
+
+        Each distinct article is tried as an exact key first and then via its
+        fallback key (see `get_fallback_key`). Returns a DataFrame aligned with
+        `articles` with the columns:
+          - MATCH: "direct", "fallback" or "" (no match)
+          - KEY: the key that matched, or NaN
+          - ROW: position of the last matching row in the table, or -1
+          - REGION: the key column the key was found in, or "" (no match)
+          - FALLBACK_ROW: position of the last row matching the fallback key,
+            or -1, also for direct matches (see `take_filled`)
+        A direct match in any key column wins over a fallback match. The
+        fallback key is looked up in every key column too, so it may match
+        another region's column than the article itself (e.g. EUR article
+        60112-85896-BLCK via GBP item no. 60112).
+        """
+        articles = pd.Series(articles)
+        distinct = pd.Series(pd.unique(articles.to_numpy()), dtype=object)
+        fallback = fallback_keys(distinct)
+
+        known = self._last_row.index
+        direct = distinct.isin(known).to_numpy()
+        via_fallback = ~direct & fallback.isin(known).to_numpy()
+        key = distinct.where(direct, fallback.where(via_fallback))
+        row = key.map(self._last_row).fillna(-1).astype(np.int64)
+        fallback_row = fallback.map(self._last_row).fillna(-1).astype(np.int64)
+        match = np.select([direct, via_fallback], [MATCH_DIRECT, MATCH_FALLBACK], MATCH_NONE)
+        region_names = np.array(self.key_columns + ("",), dtype=object)
+        region = region_names[key.map(self._region).fillna(-1).astype(np.int64).to_numpy()]
+
+        positions = pd.Index(distinct).get_indexer(articles.to_numpy())
+        return pd.DataFrame(
+            {
+                "MATCH": match[positions],
+                "KEY": key.to_numpy()[positions],
+                "ROW": row.to_numpy()[positions],
+                "REGION": region[positions],
+                "FALLBACK_ROW": fallback_row.to_numpy()[positions],
+            },
+            index=articles.index,
+        )
+
+    def expand(self, resolution):
+        """
+        Fans a resolution out over every table row sharing the matched key
+        in the matched key column, like a left merge would. Returns two
+        aligned integer arrays: the position in `resolution` and the table
+        row (-1 where nothing matched).
+        """
+        regions = {column: region for region, column in enumerate(self.key_columns)}
+        pairs = pd.DataFrame({
+            "POS": np.arange(len(resolution)),
+            "KEY": resolution["KEY"].to_numpy(),
+            "REGION": resolution["REGION"].map(regions).fillna(-1).astype(np.int8).to_numpy(),
+        })
+        merged = pairs.merge(self._pairs, on=["KEY", "REGION"], how="left", sort=False)
+        return merged["POS"].to_numpy(), merged["ROW"].fillna(-1).astype(np.int64).to_numpy()
+
+    def take(self, rows):
+        """Returns the table rows at the given positions; -1 gives an all-NaN row."""
+        return self.frame.reindex(rows).reset_index(drop=True)
+
+    def take_filled(self, resolution, positions, rows):
+        """
+        Like `take(rows)` for the output of `expand(resolution)`, but the
+        empty cells of a direct match are filled from the row its fallback
+        key matches, as the original merge + combine_first did: e.g. a color
+        variant without a GBP item no. gets the one of its base article.
+        """
+        taken = self.take(rows)
+        fallback_rows = resolution["FALLBACK_ROW"].to_numpy()[positions]
+        fill = (rows >= 0) & (fallback_rows >= 0) & (fallback_rows != rows)
+        if not fill.any():
+            return taken
+        filler = self.take(np.where(fill, fallback_rows, -1))
+        return taken.where(taken.notna(), filler)
+
+    def column(self, column, rows):
+        """Returns one table column at the given positions as an array; -1 gives NaN."""
+        return self.frame[column].reindex(rows).to_numpy()
+
+
+_INDEX_CACHE = {}
+_INDEX_CACHE_SIZE = 8
+_INDEX_LOCK = threading.Lock()
+
+
+def article_index(frame, key_column):
+    """
+    Returns the ArticleIndex for a reference frame, building it on first use.
+
+    Reference frames come from the process-wide reference cache, so the frame
+    object identifies the reference-data version: a reload yields a new frame
+    and therefore a new index, while all sessions share the current one.
+    """
+    cache_key = (id(frame), key_column)
+    with _INDEX_LOCK:
+        entry = _INDEX_CACHE.get(cache_key)
+        if entry is not None and entry[0] is frame:
+            return entry[1]
+    index = ArticleIndex(frame, key_column)
+    _store_index(frame, key_column, index)
+    return index
+
+
+def patch_article_indexes(old_frame, frame, kept):
+    """
+    Carries every cached ArticleIndex of `old_frame` (one per key column
+    spec) over to `frame`, a refreshed copy of it (see refdata.apply_changes).
+    Each index is patched with only the inserted, updated and deleted rows,
+    or rebuilt when `kept` is None (the columns changed).
+    """
+    with _INDEX_LOCK:
+        indexes = [index for cached_frame, index in _INDEX_CACHE.values() if cached_frame is old_frame]
+    for index in indexes:
+        if kept is not None:
+            patched = index.patched(frame, kept)
+        else:
+            patched = ArticleIndex(frame, index.key_column)
+        _store_index(frame, index.key_column, patched)
+
+
+def _store_index(frame, key_column, index):
+    cache_key = (id(frame), key_column)
+    with _INDEX_LOCK:
+        if len(_INDEX_CACHE) >= _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.pop(next(iter(_INDEX_CACHE)))
+        _INDEX_CACHE[cache_key] = (frame, index)
@@ -0,0 +1,217 @@
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+#####################
+# Per-stage timing instrumentation
+#####################
+
+METRICS_FILE_ENV = "CONVERTER_METRICS_FILE"
+TRACE_MEMORY_ENV = "CONVERTER_TRACE_MEMORY"
+DEBUG_ENV = "CONVERTER_DEBUG"
+
+logger = logging.getLogger("converter.metrics")
+
+_current = contextvars.ContextVar("converter_run", default=None)
+
+
+class RunCancelled(Exception):
+    """Raised at the start of a stage when its run was cancelled (see RunMetrics.cancel)."""
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def debug_enabled():
+    """True when the Streamlit debug panel is switched on with CONVERTER_DEBUG=1."""
+    return _env_flag(DEBUG_ENV)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _rss_mb():
+    """The current resident set size in MB, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as fh:
+            resident_pages = int(fh.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+# tracemalloc is process-wide: runs that overlap (e.g. two background jobs)
+# share one tracing session, which stops when the last of them finishes
+_tracing_users = 0
+_tracing_lock = threading.Lock()
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            # Traced by someone else: leave starting and stopping to them
+            return False
+        if _tracing_users == 0:
+            tracemalloc.start()
+        _tracing_users += 1
+        return True
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+
+
+class RunMetrics:
+    """
+    Timings of one request (a Streamlit rerun or one batch file), one record
+    per stage: wall time, rows processed and memory.
+
+    Memory is the RSS after the stage (`rss_mb`) and its growth during the
+    stage (`rss_delta_mb`), where /proc is available, plus the process peak
+    RSS so far (`process_peak_rss_mb`, which never goes down and so only
+    tells which stage first reached it). With CONVERTER_TRACE_MEMORY=1 (or
+    trace_memory=True) the peak Python allocation during the stage is
+    measured with tracemalloc as well, which is exact but slows the run
+    down. Both RSS and tracemalloc are process-wide, so stages of runs in
+    other threads count towards them too. Stages may nest (e.g. the lazy resolution inside
+    sku_merge): the inner time is included in the outer stage, and the
+    inner stage resets the outer tracemalloc peak.
+    """
+
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.started_at = time.time()
+        self.seconds = None
+        self.profile_text = None
+        self.active_stage = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Asks the run to stop; the next stage that starts raises RunCancelled."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def to_dict(self):
+        return {
+            "run": self.name,
+            "started_at": round(self.started_at, 3),
+            "seconds": self.seconds,
+            "stages": self.stages,
+        }
+
+
+@contextmanager
+def run(name, profile=False, profile_path=None, trace_memory=None, metrics=None):
+    """
+    Records the stages of one request. On exit the run is logged as one JSON
+    line on the "converter.metrics" logger and, if CONVERTER_METRICS_FILE is
+    set, appended to that file.
+
+    With `profile=True` the run is also captured with cProfile: the 30 most
+    expensive functions (by cumulative time) end up in `profile_text`, and
+    the raw stats are written to `profile_path` if given (for snakeviz etc.).
+    Pass `metrics` to record into a RunMetrics created up front (e.g. by a
+    background job that reports its progress while running).
+    """
+    if trace_memory is None:
+        trace_memory = _env_flag(TRACE_MEMORY_ENV)
+    if metrics is None:
+        metrics = RunMetrics(name, trace_memory)
+    token = _current.set(metrics)
+    started_tracing = trace_memory and _start_tracing()
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        metrics.seconds = round(time.perf_counter() - start, 4)
+        if started_tracing:
+            _stop_tracing()
+        _current.reset(token)
+        if profiler is not None:
+            if profile_path:
+                profiler.dump_stats(profile_path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(30)
+            metrics.profile_text = text.getvalue()
+        _emit(metrics)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Times one stage of the current run. Yields the stage record, so the
+    caller can fill in `record["rows"]` once the row count is known. Outside
+    a run this does nothing but yield a throwaway record. Raises
+    RunCancelled instead of starting the stage if the run was cancelled.
+    """
+    metrics = _current.get()
+    record = {"stage": name, "rows": rows}
+    if metrics is None:
+        yield record
+        return
+    if metrics.cancelled:
+        raise RunCancelled(name)
+    outer_stage, metrics.active_stage = metrics.active_stage, record
+    if metrics.trace_memory:
+        tracemalloc.reset_peak()
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        rss_after = _rss_mb()
+        if rss_after is not None:
+            record["rss_mb"] = round(rss_after, 1)
+            record["rss_delta_mb"] = round(rss_after - rss_before, 1)
+        record["process_peak_rss_mb"] = _peak_rss_mb()
+        if metrics.trace_memory and tracemalloc.is_tracing():
+            record["peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        metrics.stages.append(record)
+        metrics.active_stage = outer_stage
+
+
+def current_run():
+    """Returns the RunMetrics being recorded in this context, or None."""
+    return _current.get()
+
+
+def _emit(metrics):
+    line = json.dumps(metrics.to_dict(), ensure_ascii=False, default=str)
+    logger.info(line)
+    path = os.environ.get(METRICS_FILE_ENV)
+    if path:
+        try:
+            with open(path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
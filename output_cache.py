@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+#####################
+# Cache of generated output files
+#####################
+
+OUTPUT_CACHE_DIR_ENV = "CONVERTER_OUTPUT_CACHE_DIR"
+MAX_ENTRIES = 64
+MAX_BYTES = 256 * 1024 * 1024
+MAX_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class OutputCache:
+    """
+    Process-wide LRU cache of generated files (Word, Excel, zip), shared by
+    all sessions. Keys are tuples such as (upload hash, Library version,
+    master version, output type, options); values are the file bytes.
+
+    The memory tier holds at most `max_entries` files and `max_bytes` bytes;
+    the least recently used files are evicted first. With a `disk_dir`
+    (default: the CONVERTER_OUTPUT_CACHE_DIR environment variable), every
+    file is also written to disk, up to `max_disk_bytes`, so it outlives its
+    eviction from memory and a restart, and is shared between app processes.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, disk_dir=None, max_disk_bytes=MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir if disk_dir is not None else os.environ.get(OUTPUT_CACHE_DIR_ENV)
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, build):
+        """
+        Returns the cached file for `key` as a fresh BytesIO, calling `build()`
+        (which returns a BytesIO, or None if nothing could be generated) only
+        on a miss. None results are not cached.
+        """
+        data = self.get(key)
+        if data is None:
+            buffer = build()
+            if buffer is None:
+                return None
+            data = buffer.getvalue()
+            self.put(key, data)
+        return BytesIO(data)
+
+    def get(self, key):
+        """Returns the cached bytes for `key`, or None."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        self._remember(key, data)
+        self._write_disk(key, data)
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".bin")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir or len(data) > self.max_disk_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        except OSError:
+            pass
+
+    def _trim_disk(self):
+        """Deletes the least recently used files until the disk tier fits in max_disk_bytes."""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns hit/miss counters, the hit rate and the memory tier size."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "megabytes": round(self._bytes / (1024 * 1024), 1),
+            "disk_dir": self.disk_dir,
+        }
+
+
+OUTPUT_CACHE = OutputCache()
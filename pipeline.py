@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+from ingest import consolidate_articles
+from lookup import article_index, fallback_keys
+from metrics import stage
+from refdata import LIBRARY_REGION_KEYS
+
+#####################
+# Shared resolution pass
+#####################
+
+def library_key_columns(df_library):
+    """
+    The regional item number columns of the Library data that uploads are
+    matched on (EUR first), or None without an EUR ITEM NO. column.
+    """
+    if LIBRARY_REGION_KEYS[0] not in df_library.columns:
+        return None
+    return tuple(column for column in LIBRARY_REGION_KEYS if column in df_library.columns)
+
+
+class ResolvedUpload:
+    """
+    An upload matched against the reference data once.
+
+    Holds the preprocessed upload together with its Library and master data
+    resolutions (see ArticleIndex.resolve), so the presentation list, the
+    order import file and the SKU mapping are all rendered from the same
+    intermediate. Each resolution is computed on first use and then kept.
+    """
+
+    def __init__(self, df_user, df_library, df_master, upload_digest=None):
+        self.df_user = df_user
+        self.df_library = df_library
+        self.df_master = df_master
+        # Content hash of the uploaded file, if known; keys the output cache
+        self.upload_digest = upload_digest
+
+    @cached_property
+    def library_index(self):
+        key_columns = library_key_columns(self.df_library)
+        if key_columns is None:
+            return None
+        return article_index(self.df_library, key_columns)
+
+    @cached_property
+    def master_index(self):
+        if "ITEM NO." not in self.df_master.columns:
+            return None
+        return article_index(self.df_master, "ITEM NO.")
+
+    @cached_property
+    def library(self):
+        """Library resolution (MATCH, KEY, ROW, REGION) per upload row, or None without an EUR ITEM NO. column."""
+        if self.library_index is None:
+            return None
+        with stage("resolve_library", rows=len(self.df_user)):
+            return self.library_index.resolve(self.df_user["ARTICLE_NO"])
+
+    @cached_property
+    def master(self):
+        """Master data resolution (MATCH, KEY, ROW, REGION) per upload row, or None without an ITEM NO. column."""
+        if self.master_index is None:
+            return None
+        with stage("resolve_master", rows=len(self.df_user)):
+            return self.master_index.resolve(self.df_user["ARTICLE_NO"])
+
+    @cached_property
+    def consolidated(self):
+        """
+        The same upload with repeated articles collapsed and their quantities
+        summed (see ingest.consolidate_articles), for the consolidated output mode.
+        """
+        return ResolvedUpload(consolidate_articles(self.df_user), self.df_library, self.df_master)
+
+    @cached_property
+    def order_keys(self):
+        """Fallback-cleaned article numbers for the order import file."""
+        return fallback_keys(self.df_user["ARTICLE_NO"])
+
+
+def warm_reference(df_library, df_master):
+    """Builds the Library and master lookup indexes up front, so the first upload does not pay for them."""
+    key_columns = library_key_columns(df_library)
+    if key_columns is not None:
+        article_index(df_library, key_columns)
+    if "ITEM NO." in df_master.columns:
+        article_index(df_master, "ITEM NO.")
+
+
+_RESOLVED_CACHE = OrderedDict()
+_RESOLVED_CACHE_SIZE = 16
+_RESOLVED_LOCK = threading.Lock()
+
+
+def resolve_upload(upload_digest, df_library, df_master, read_upload):
+    """
+    Returns the ResolvedUpload for an upload, memoized per upload content hash
+    and reference-data version, so Streamlit reruns and repeated clicks reuse
+    the same intermediate. `read_upload()` is only called on a miss and must
+    return the preprocessed upload, or None if it could not be read (failures
+    are not memoized).
+    """
+    cache_key = (upload_digest, id(df_library), id(df_master))
+    with _RESOLVED_LOCK:
+        resolved = _RESOLVED_CACHE.get(cache_key)
+        if resolved is not None and resolved.df_library is df_library and resolved.df_master is df_master:
+            _RESOLVED_CACHE.move_to_end(cache_key)
+            return resolved
+
+    df_user = read_upload()
+    if df_user is None:
+        return None
+    resolved = ResolvedUpload(df_user, df_library, df_master, upload_digest)
+    with _RESOLVED_LOCK:
+        _RESOLVED_CACHE[cache_key] = resolved
+        while len(_RESOLVED_CACHE) > _RESOLVED_CACHE_SIZE:
+            _RESOLVED_CACHE.popitem(last=False)
+    return resolved
@@ -0,0 +1,453 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from lookup import patch_article_indexes
+
+#####################
+# Reference data (Library / Master) - parsing and process-wide cache
+#####################
+
+LIBRARY_PATH = "Library_data.xlsx"
+MASTER_PATH = "Muuto_Master_Data_CON_January_2025_EUR.xlsx"
+SNAPSHOT_DIR = ".snapshots"
+SNAPSHOT_FORMAT = 1
+LIBRARY_KEY = "EUR ITEM NO."
+# Library columns an upload can be matched on, in priority order
+LIBRARY_REGION_KEYS = (LIBRARY_KEY, "GBP ITEM NO.", "APMEA ITEM NO.", "USD PATTERN NO.")
+MASTER_KEY = "ITEM NO."
+COMPACT_MASTER_ENV = "CONVERTER_COMPACT_MASTER"
+MASTER_COLUMNS_ENV = "CONVERTER_MASTER_COLUMNS"
+CATEGORY_MAX_RATIO = 0.5
+
+
+def read_library(library_path):
+    """
+    Parses Library_data.xlsx, trims and converts column names to uppercase
+    and normalizes the EUR ITEM NO. lookup key (stripped, uppercase).
+    """
+    df = pd.read_excel(library_path, engine="openpyxl")
+    df.columns = df.columns.str.strip().str.upper()
+    if LIBRARY_KEY in df.columns:
+        df[LIBRARY_KEY] = df[LIBRARY_KEY].astype(str).str.strip().str.upper()
+    return df
+
+
+def read_master(master_path):
+    """
+    Parses the master data workbook, trims and converts column names to uppercase
+    and normalizes the ITEM NO. lookup key (stripped, uppercase).
+    """
+    df = pd.read_excel(master_path, engine="openpyxl")
+    df.columns = df.columns.str.strip().str.upper()
+    if MASTER_KEY in df.columns:
+        df[MASTER_KEY] = df[MASTER_KEY].astype(str).str.strip().str.upper()
+    return df
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Returns the SHA-1 hex digest of the file content."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+#####################
+# Compiled snapshots
+#####################
+
+def snapshot_path(source_path):
+    """Returns the snapshot location for a source workbook: `.snapshots/<file name>.pkl` next to it."""
+    source_path = os.path.abspath(source_path)
+    return os.path.join(os.path.dirname(source_path), SNAPSHOT_DIR, os.path.basename(source_path) + ".pkl")
+
+
+def compile_snapshot(source_path, parse):
+    """
+    Parses `source_path` with `parse` and writes the normalized frame, together
+    with the source checksum, to a pickled snapshot. The snapshot is written to
+    a temporary file and moved into place, so readers never see a partial file.
+    Returns the snapshot path.
+    """
+    digest = file_digest(source_path)
+    frame = parse(source_path)
+    target = snapshot_path(source_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "pandas": pd.__version__,
+        "source_digest": digest,
+        "frame": frame,
+    }
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        pickle.dump(payload, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, target)
+    return target
+
+
+def load_snapshot(source_path, digest):
+    """
+    Returns the frame stored in the snapshot of `source_path` if it was compiled
+    from content with the given digest by the same snapshot format and pandas
+    version. Returns None if the snapshot is missing, stale or unreadable.
+    """
+    try:
+        with open(snapshot_path(source_path), "rb") as fh:
+            payload = pickle.load(fh)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if (
+        not isinstance(payload, dict)
+        or payload.get("format") != SNAPSHOT_FORMAT
+        or payload.get("pandas") != pd.__version__
+        or payload.get("source_digest") != digest
+    ):
+        return None
+    return payload["frame"]
+
+
+def compile_reference_data(library_path=LIBRARY_PATH, master_path=MASTER_PATH):
+    """Compiles snapshots of both reference workbooks and returns their paths."""
+    return [
+        compile_snapshot(library_path, read_library),
+        compile_snapshot(master_path, read_master),
+    ]
+
+
+def _snapshot_or_parse(parse):
+    """Wraps a workbook parser so a fresh snapshot is preferred over parsing the XLSX."""
+    def load(path, digest):
+        frame = load_snapshot(path, digest)
+        if frame is None:
+            frame = parse(path)
+        return frame
+    return load
+
+
+#####################
+# Compact in-memory representation
+#####################
+
+def _megabytes(nbytes):
+    return round(nbytes / (1024 * 1024), 3)
+
+
+def _downcast(values):
+    """Downcasts a numeric column to the smallest dtype that holds every value exactly."""
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast="integer")
+    if pd.api.types.is_float_dtype(values):
+        smaller = values.astype("float32")
+        if smaller.astype(values.dtype).equals(values):
+            return smaller
+    return values
+
+
+def project_columns(df, key_column, columns):
+    """Returns `df` with only `columns` (plus the key column), in their original order."""
+    wanted = set(columns)
+    return df[[column for column in df.columns if column == key_column or column in wanted]]
+
+
+def compact_frame(df, key_column, columns=None, max_category_ratio=CATEGORY_MAX_RATIO):
+    """
+    Returns a compact copy of a reference table and a per-column memory report:
+      - `columns` (optional): keep only these columns (plus the key column).
+      - text columns (object or pandas' string dtype) with few distinct
+        values (at most `max_category_ratio` of the rows) become categoricals.
+      - numeric columns are downcast where that is lossless.
+      - the key column stays plain text (the lookup index needs it), with
+        every key interned so equal keys share one string object.
+    Cell values are unchanged, so the exports written from it are the same.
+    """
+    if columns:
+        df = project_columns(df, key_column, columns)
+    before = df.memory_usage(index=False, deep=True)
+    out = {}
+    for column in df.columns:
+        values = df[column]
+        if column == key_column:
+            values = values.map(lambda key: sys.intern(key) if isinstance(key, str) else key)
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            if values.nunique(dropna=True) <= max_category_ratio * len(values):
+                values = values.astype("category")
+        else:
+            values = _downcast(values)
+        out[column] = values
+    compact = pd.DataFrame(out, index=df.index)
+    after = compact.memory_usage(index=False, deep=True)
+    report = {
+        "columns": {
+            str(column): {
+                "dtype": str(compact[column].dtype),
+                "before_mb": _megabytes(before[column]),
+                "after_mb": _megabytes(after[column]),
+            }
+            for column in compact.columns
+        },
+        "before_mb": _megabytes(before.sum()),
+        "after_mb": _megabytes(after.sum()),
+    }
+    compact.attrs["memory_report"] = report
+    return compact, report
+
+
+def _compact_master(frame):
+    """Compacts the master data unless CONVERTER_COMPACT_MASTER=0."""
+    if os.environ.get(COMPACT_MASTER_ENV, "1").strip().lower() in ("0", "false", "no", "off"):
+        return frame
+    return compact_frame(frame, MASTER_KEY)[0]
+
+
+def master_columns():
+    """The master data columns CONVERTER_MASTER_COLUMNS keeps (uppercase), or () to keep them all."""
+    return tuple(c.strip().upper() for c in os.environ.get(MASTER_COLUMNS_ENV, "").split(",") if c.strip())
+
+
+def _project_master(parse):
+    """
+    Wraps a master data parser so every parsed version keeps only the
+    CONVERTER_MASTER_COLUMNS columns (if set). The projection has to happen
+    before an incremental reload diffs the new version against the cached one,
+    or every key would count as changed.
+    """
+    def load(path, digest):
+        frame = parse(path, digest)
+        columns = master_columns()
+        return project_columns(frame, MASTER_KEY, list(columns)) if columns else frame
+    return load
+
+
+#####################
+# Incremental refresh
+#####################
+
+def _rows_per_key(frame, key_column):
+    """Returns a Series mapping every key to the tuple of row hashes carrying it, in row order."""
+    # Hash numbers as float64, so a compacted (downcast) copy hashes like the parsed one
+    numeric = frame.select_dtypes("number").columns
+    if len(numeric):
+        frame = frame.astype({column: "float64" for column in numeric})
+    hashes = pd.util.hash_pandas_object(frame, index=False)
+    return hashes.groupby(frame[key_column].to_numpy(), sort=False, dropna=False).agg(tuple)
+
+
+def diff_frames(old, new, key_column):
+    """
+    Compares two versions of a reference table by their key column
+    (EUR ITEM NO. / ITEM NO.). Returns a change report with the sorted keys
+    that were added, removed and changed. A key counts as changed when any
+    of the rows carrying it differ in any column; if the columns themselves
+    differ, every shared key counts as changed.
+    """
+    old_rows = _rows_per_key(old, key_column)
+    new_rows = _rows_per_key(new, key_column)
+    shared = old_rows.index.intersection(new_rows.index)
+    if list(old.columns) == list(new.columns):
+        changed = shared[(old_rows[shared] != new_rows[shared]).to_numpy()]
+    else:
+        changed = shared
+    return {
+        "key_column": key_column,
+        "added": sorted(map(str, new_rows.index.difference(old_rows.index))),
+        "removed": sorted(map(str, old_rows.index.difference(new_rows.index))),
+        "changed": sorted(map(str, changed)),
+        "columns_changed": list(old.columns) != list(new.columns),
+        "rows_before": len(old),
+        "rows_after": len(new),
+    }
+
+
+def apply_changes(old, new, changes):
+    """
+    Applies a change report (see diff_frames) to `old` and returns
+    (frame, kept): the rows of `old` whose key was neither removed nor
+    changed, followed by the rows of `new` whose key was added or changed,
+    and the boolean mask of `old` rows that were kept. `old` itself is not
+    modified, so sessions still holding it are unaffected. When the columns
+    changed, `new` is returned as is and `kept` is None.
+    """
+    if changes["columns_changed"]:
+        return new.reset_index(drop=True), None
+    key_column = changes["key_column"]
+    outdated = set(changes["removed"]) | set(changes["changed"])
+    incoming = set(changes["added"]) | set(changes["changed"])
+    kept = ~old[key_column].astype(str).isin(outdated).to_numpy()
+    frame = pd.concat(
+        [old[kept], new[new[key_column].astype(str).isin(incoming).to_numpy()]],
+        ignore_index=True,
+    )
+    return frame, kept
+
+
+def _summary(changes):
+    """Counts of a change report, for logs and the cache stats."""
+    return {
+        "added": len(changes["added"]),
+        "removed": len(changes["removed"]),
+        "changed": len(changes["changed"]),
+        "columns_changed": changes["columns_changed"],
+    }
+
+
+#####################
+# Process-wide cache
+#####################
+
+class ReferenceCache:
+    """
+    Process-wide cache of parsed reference workbooks, shared by all sessions.
+
+    Entries are keyed by absolute path. A lookup is a hit when the file's
+    mtime and size are unchanged; if they changed, the content hash decides
+    whether the file really changed (e.g. a `touch` or a copy of identical
+    content is still a hit). Only a changed hash triggers a reload.
+
+    When a `key_column` is given, a reload is incremental: the new version
+    is diffed against the loaded one (see diff_frames), only the inserted,
+    updated and deleted rows are applied, and the lookup indexes are patched
+    rather than rebuilt. The entry then keeps the change report.
+    `finish`, if given, post-processes the frame that ends up cached (e.g.
+    compact_frame), after any incremental changes were applied.
+
+    The returned DataFrames are shared between sessions and must be treated
+    as read-only by the callers.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def get(self, path, parse, key_column=None, finish=None):
+        """Returns the parsed frame for `path`, calling `parse(path, digest)` only when the file changed."""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["stamp"] == (stat.st_mtime_ns, stat.st_size):
+                return self._hit(entry)
+            digest = file_digest(key)
+            if entry is not None and entry["digest"] == digest:
+                entry["stamp"] = (stat.st_mtime_ns, stat.st_size)
+                return self._hit(entry)
+
+            start = time.perf_counter()
+            frame = parse(key, digest)
+            changes = None
+            if entry is not None and key_column in entry["frame"].columns and key_column in frame.columns:
+                changes = diff_frames(entry["frame"], frame, key_column)
+                frame, kept = apply_changes(entry["frame"], frame, changes)
+                if finish is not None:
+                    frame = finish(frame)
+                patch_article_indexes(entry["frame"], frame, kept)
+            elif finish is not None:
+                frame = finish(frame)
+            elapsed = time.perf_counter() - start
+            self.misses += 1
+            self.load_seconds += elapsed
+            self._entries[key] = {
+                "stamp": (stat.st_mtime_ns, stat.st_size),
+                "digest": digest,
+                "frame": frame,
+                "load_seconds": elapsed,
+                "loaded_at": time.time(),
+                "changes": changes,
+            }
+            return frame
+
+    def refresh(self, path, parse, key_column=None, finish=None):
+        """
+        Picks up a changed file now instead of on the next request, and
+        returns the change report (see diff_frames) of the incremental reload
+        this call triggered, or None if the file was unchanged (or loaded for
+        the first time, or reloaded in full). The report of the last reload
+        stays available in `stats()`.
+        """
+        key = os.path.abspath(path)
+        with self._lock:
+            before = self._entries.get(key)
+        self.get(path, parse, key_column, finish)
+        entry = self._entries[key]
+        return entry["changes"] if entry is not before else None
+
+    def _hit(self, entry):
+        self.hits += 1
+        self.saved_seconds += entry["load_seconds"]
+        return entry["frame"]
+
+    def version(self, path):
+        """Returns the content hash of the cached copy of `path`, or None if it is not loaded."""
+        entry = self._entries.get(os.path.abspath(path))
+        return entry["digest"] if entry else None
+
+    def version_of(self, frame):
+        """Returns the content hash of the file a cached frame was loaded from, or None if it is not cached."""
+        for entry in list(self._entries.values()):
+            if entry["frame"] is frame:
+                return entry["digest"]
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters, total parse time and the parse time saved by hits."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "load_seconds": round(self.load_seconds, 3),
+            "saved_seconds": round(self.saved_seconds, 3),
+            "files": {
+                os.path.basename(path): {
+                    "digest": entry["digest"][:12],
+                    "rows": len(entry["frame"]),
+                    "memory_mb": entry["frame"].attrs.get("memory_report", {}).get("after_mb"),
+                    "load_seconds": round(entry["load_seconds"], 3),
+                    "last_changes": _summary(entry["changes"]) if entry["changes"] else None,
+                }
+                for path, entry in self._entries.items()
+            },
+        }
+
+
+REFERENCE_CACHE = ReferenceCache()
+
+
+def library_data(library_path=LIBRARY_PATH):
+    """Returns the cached Library data, loading the snapshot or workbook only when it changed."""
+    return REFERENCE_CACHE.get(library_path, _snapshot_or_parse(read_library), LIBRARY_KEY)
+
+
+def master_data(master_path=MASTER_PATH):
+    """
+    Returns the cached master data, loading the snapshot or workbook only when
+    it changed. The frame is compacted (see compact_frame) unless
+    CONVERTER_COMPACT_MASTER=0, CONVERTER_MASTER_COLUMNS keeps only the listed
+    columns, and one read-only copy is shared by all sessions.
+    """
+    return REFERENCE_CACHE.get(master_path, _project_master(_snapshot_or_parse(read_master)), MASTER_KEY, _compact_master)
+
+
+def refresh_reference_data(library_path=LIBRARY_PATH, master_path=MASTER_PATH):
+    """
+    Applies changed reference workbooks to the cache incrementally and
+    returns {"library": report, "master": report} with the change report of
+    each file, or None where nothing changed (see ReferenceCache.refresh).
+    """
+    return {
+        "library": REFERENCE_CACHE.refresh(library_path, _snapshot_or_parse(read_library), LIBRARY_KEY),
+        "master": REFERENCE_CACHE.refresh(master_path, _project_master(_snapshot_or_parse(read_master)), MASTER_KEY, _compact_master),
+    }
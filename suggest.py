@@ -0,0 +1,157 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from lookup import MATCH_NONE
+from metrics import stage
+
+#####################
+# Near-match suggestions for unmatched articles
+#####################
+
+NGRAM = 3
+DEFAULT_TOP = 5
+MIN_SCORE = 0.3
+
+SOURCE_LIBRARY_ITEM = "Library EUR item no."
+SOURCE_MASTER_ITEM = "Master ITEM NO."
+SOURCE_PRODUCT = "Library product name"
+
+
+def _ngrams(text):
+    """The set of character trigrams of `text`, padded so short strings and word edges count."""
+    text = f" {text.strip().upper()} "
+    return {text[i:i + NGRAM] for i in range(max(len(text) - NGRAM + 1, 1))}
+
+
+class NgramIndex:
+    """
+    Inverted trigram index over a list of strings. A query only touches the
+    strings sharing at least one trigram with it (via the posting lists),
+    and scores them with the Dice coefficient of their trigram sets, so
+    looking up hundreds of misses does not scan the reference data pairwise.
+    """
+
+    def __init__(self, values):
+        distinct = pd.unique(pd.Series(values, dtype=object).dropna().astype(str).str.strip())
+        self.values = np.asarray([value for value in distinct if value], dtype=object)
+        postings = defaultdict(list)
+        sizes = np.zeros(len(self.values), dtype=np.int32)
+        for position, value in enumerate(self.values):
+            grams = _ngrams(value)
+            sizes[position] = len(grams)
+            for gram in grams:
+                postings[gram].append(position)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._sizes = sizes
+
+    def __len__(self):
+        return len(self.values)
+
+    def query(self, text, top=DEFAULT_TOP, min_score=MIN_SCORE):
+        """Returns up to `top` (value, score) pairs with a score of at least `min_score`, best first."""
+        grams = [gram for gram in _ngrams(text) if gram in self._postings]
+        if not grams or not len(self.values):
+            return []
+        shared = np.zeros(len(self.values), dtype=np.int32)
+        for gram in grams:
+            shared[self._postings[gram]] += 1
+        candidates = np.flatnonzero(shared)
+        scores = 2.0 * shared[candidates] / (len(_ngrams(text)) + self._sizes[candidates])
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > top:
+            best = np.argpartition(-scores, top - 1)[:top]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return [(self.values[candidates[i]], round(float(scores[i]), 3)) for i in order]
+
+
+class SuggestionIndex:
+    """
+    The trigram indexes used for suggestions: Library EUR item numbers,
+    master ITEM NO. and Library product names, with the product name per
+    Library item number for display.
+    """
+
+    def __init__(self, df_library, df_master):
+        has_library = "EUR ITEM NO." in df_library.columns
+        self.library_items = NgramIndex(df_library["EUR ITEM NO."] if has_library else [])
+        self.master_items = NgramIndex(df_master["ITEM NO."] if "ITEM NO." in df_master.columns else [])
+        if has_library and "PRODUCT" in df_library.columns:
+            products = df_library[["EUR ITEM NO.", "PRODUCT"]].dropna()
+            self.products = NgramIndex(products["PRODUCT"])
+            self.product_by_item = products.drop_duplicates("EUR ITEM NO.", keep="last").set_index("EUR ITEM NO.")["PRODUCT"]
+            self.item_by_product = products.drop_duplicates("PRODUCT", keep="last").set_index("PRODUCT")["EUR ITEM NO."]
+        else:
+            self.products = NgramIndex([])
+            self.product_by_item = pd.Series(dtype=object)
+            self.item_by_product = pd.Series(dtype=object)
+
+    def candidates(self, article, short_text, top=DEFAULT_TOP):
+        """Returns the `top` best (item no., product, matched on, score) candidates for one upload row."""
+        found = []
+        for value, score in self.library_items.query(article, top):
+            found.append((value, self.product_by_item.get(value, ""), SOURCE_LIBRARY_ITEM, score))
+        for value, score in self.master_items.query(article, top):
+            found.append((value, self.product_by_item.get(value, ""), SOURCE_MASTER_ITEM, score))
+        if short_text:
+            for value, score in self.products.query(short_text, top):
+                found.append((self.item_by_product.get(value, ""), value, SOURCE_PRODUCT, score))
+        found.sort(key=lambda candidate: -candidate[3])
+        best, seen = [], set()
+        for candidate in found:
+            if candidate[0] in seen:
+                continue
+            seen.add(candidate[0])
+            best.append(candidate)
+            if len(best) == top:
+                break
+        return best
+
+
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def suggestion_index(df_library, df_master):
+    """
+    Returns the SuggestionIndex for the current reference data, building it
+    on first use. Like lookup.article_index, the frame objects identify the
+    reference-data version; only the latest index is kept.
+    """
+    with _INDEX_LOCK:
+        entry = _INDEX_CACHE.get("current")
+        if entry is not None and entry[0] is df_library and entry[1] is df_master:
+            return entry[2]
+    index = SuggestionIndex(df_library, df_master)
+    with _INDEX_LOCK:
+        _INDEX_CACHE["current"] = (df_library, df_master, index)
+    return index
+
+
+SUGGESTION_COLUMNS = ["Article No.", "Short Text", "Variant text", "Rank", "Suggested item no.", "Product", "Matched on", "Score"]
+
+
+def suggest_unmatched(resolved, top=DEFAULT_TOP):
+    """
+    Proposes the `top` closest item numbers and product names for every
+    distinct upload line (ARTICLE_NO, SHORT_TEXT, VARIANT_TEXT) that matched
+    neither the Library nor the master data, directly or via fallback.
+    Returns a DataFrame with SUGGESTION_COLUMNS, one row per candidate.
+    """
+    df_user = resolved.df_user
+    unmatched = np.ones(len(df_user), dtype=bool)
+    for resolution in (resolved.library, resolved.master):
+        if resolution is not None:
+            unmatched &= (resolution["MATCH"] == MATCH_NONE).to_numpy()
+    lines = df_user[unmatched].drop_duplicates(["ARTICLE_NO", "SHORT_TEXT", "VARIANT_TEXT"])
+    rows = []
+    with stage("suggestions", rows=len(lines)):
+        index = suggestion_index(resolved.df_library, resolved.df_master)
+        for article, short_text, variant_text in lines[["ARTICLE_NO", "SHORT_TEXT", "VARIANT_TEXT"]].itertuples(index=False):
+            for rank, (item, product, source, score) in enumerate(index.candidates(article, short_text, top), start=1):
+                rows.append((article, short_text, variant_text, rank, item, product, source, score))
+    return pd.DataFrame(rows, columns=SUGGESTION_COLUMNS)
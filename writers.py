@@ -0,0 +1,136 @@
+import os
+import tempfile
+from io import BytesIO
+
+import pandas as pd
+
+from metrics import stage
+
+#####################
+# XLSX writer backends
+#####################
+
+WRITER_ENV = "CONVERTER_XLSX_WRITER"
+DEFAULT_BACKEND = "openpyxl"
+BACKENDS = ("openpyxl", "openpyxl-write-only", "xlsxwriter")
+DEFAULT_SHEET_NAME = "Sheet1"
+
+
+def writer_backend(backend=None):
+    """
+    Returns the configured XLSX writer backend: the explicit `backend`, else
+    the CONVERTER_XLSX_WRITER environment variable, else "openpyxl".
+      - openpyxl: pandas ExcelWriter with openpyxl (full per-cell object model).
+      - openpyxl-write-only: openpyxl write-only workbook, streamed row by row.
+      - xlsxwriter: xlsxwriter in constant_memory mode (needs the xlsxwriter package).
+    """
+    backend = (backend or os.environ.get(WRITER_ENV) or DEFAULT_BACKEND).strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Ukendt XLSX-writer '{backend}'. Vælg en af: {', '.join(BACKENDS)}.")
+    return backend
+
+
+def _rows(df, header):
+    """Yields the rows of `df` as lists of plain Python values, with NaN as None."""
+    if header:
+        yield [str(column) for column in df.columns]
+    values = df.astype(object).where(df.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        yield list(row)
+
+
+def _write_pandas(sheets):
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for sheet_name, df, header in sheets:
+            df.to_excel(writer, sheet_name=sheet_name or DEFAULT_SHEET_NAME, index=False, header=header)
+    buffer.seek(0)
+    return buffer
+
+
+def _write_openpyxl_write_only(sheets):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    thin = Side(style="thin")
+    for sheet_name, df, header in sheets:
+        sheet = workbook.create_sheet(sheet_name or DEFAULT_SHEET_NAME)
+        if len(df.columns):
+            # Write-only sheets have no <dimension> and skip empty trailing
+            # cells, so readers that size rows from the dimension (openpyxl
+            # read-only, import tools) would see short rows. The size is known
+            # up front; the sheet writer picks it up from calculate_dimension.
+            ref = f"A1:{get_column_letter(len(df.columns))}{max(len(df) + bool(header), 1)}"
+            sheet.calculate_dimension = lambda ref=ref: ref
+        rows = _rows(df, header)
+        if header:
+            header_cells = []
+            for value in next(rows):
+                cell = WriteOnlyCell(sheet, value=value)
+                # Same header style as pandas' to_excel
+                cell.font = Font(bold=True)
+                cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+                cell.alignment = Alignment(horizontal="center", vertical="top")
+                header_cells.append(cell)
+            sheet.append(header_cells)
+        for row in rows:
+            sheet.append(row)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def _write_xlsxwriter(sheets):
+    import xlsxwriter
+
+    # constant_memory flushes each row to a temp file, which needs a real
+    # output file rather than an in-memory one.
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {
+            "constant_memory": True,
+            "strings_to_numbers": False,
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "nan_inf_to_errors": True,
+        })
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        for sheet_name, df, header in sheets:
+            sheet = workbook.add_worksheet(sheet_name or DEFAULT_SHEET_NAME)
+            rows = _rows(df, header)
+            row_number = 0
+            if header:
+                sheet.write_row(row_number, 0, next(rows), header_format)
+                row_number += 1
+            for row in rows:
+                sheet.write_row(row_number, 0, row)
+                row_number += 1
+        workbook.close()
+        with open(path, "rb") as fh:
+            buffer = BytesIO(fh.read())
+    finally:
+        os.remove(path)
+    return buffer
+
+
+_WRITERS = {
+    "openpyxl": _write_pandas,
+    "openpyxl-write-only": _write_openpyxl_write_only,
+    "xlsxwriter": _write_xlsxwriter,
+}
+
+
+def write_xlsx(sheets, backend=None):
+    """
+    Writes one or more DataFrames to an XLSX file and returns it as BytesIO.
+    `sheets` is a list of (sheet name or None, DataFrame, header) tuples;
+    the index is never written. The backend is chosen by `writer_backend`.
+    """
+    backend = writer_backend(backend)
+    with stage(f"xlsx_write:{backend}", rows=sum(len(df) for _, df, _ in sheets)):
+        return _WRITERS[backend](sheets)